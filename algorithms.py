@@ -1,6 +1,11 @@
 import random
+import gp
 import support
 
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from contextlib import nullcontext
+from functools import partial
+
 def variation(population, toolbox, cxpb, mutpb):
     offspring = [toolbox.clone(ind) for ind in population]
 
@@ -18,42 +23,238 @@ def variation(population, toolbox, cxpb, mutpb):
     return offspring
 
 
-def evolutionaryAlgorithm(population, toolbox, cxpb, mutpb, ngen, stats=None,halloffame=None, verbose=__debug__):
-    logbook = support.LogStats()
-    logbook.header = ['gen', 'nevals'] + (stats.fields if stats else [])
+def inheritFitness(parents, offspring):
+    """Give every offspring with an invalid fitness the fitness of its
+    parent, the individual at the same position in *parents*, when the
+    subtree replaced by the variation was never executed during the
+    evaluation of the parent. The evaluation records the run in the
+    ``coverage`` of the individuals, indexing it by node is true for the
+    nodes executed. An offspring inheriting a fitness gets the coverage
+    ``replace(slice_, size)`` returns, the other ones the coverage
+    ``prefix(slice_, size)`` returns as ``resume`` for the evaluation to
+    resume from the run of the parent. Return the number of offspring that
+    inherited.
+    """
+    inherited = 0
+    for parent, child in zip(parents, offspring):
+        if child.fitness.valid:
+            continue
+        coverage = getattr(parent, "coverage", None)
+        changed = gp.changedSubtree(parent, child)
+        if coverage is not None and parent.fitness.valid and (changed is None or not coverage[changed[0].start]):
+            child.fitness.values = parent.fitness.values
+            if changed is not None:
+                child.coverage = coverage.replace(*changed)
+            inherited += 1
+        else:
+            # The coverage of the parent only describes the offspring until
+            # the changed subtree first runs
+            child.coverage = None
+            child.resume = coverage.prefix(*changed) if coverage is not None and changed is not None else None
+    return inherited
 
-    # Evaluate the individuals with an invalid fitness
-    invalid_ind = [ind for ind in population if not ind.fitness.valid]
-    fitnesses = toolbox.map(toolbox.evaluate, invalid_ind)
+
+def evaluation(individuals, toolbox, cache=None):
+    """Evaluate the individuals with an invalid fitness and return them. When
+    the toolbox provides an ``evaluate_population`` function, all of them are
+    evaluated in a single call. When a *cache* is given, individuals already
+    seen are not evaluated again. When the toolbox provides a ``simplify``
+    function, it is first applied to each of them in this process.
+    """
+    invalid_ind = [ind for ind in individuals if not ind.fitness.valid]
+    if hasattr(toolbox, "simplify"):
+        for ind in invalid_ind:
+            toolbox.simplify(ind)
+    if hasattr(toolbox, "evaluate_population"):
+        batch = toolbox.evaluate_population
+    else:
+        batch = partial(toolbox.map, toolbox.evaluate)
+    if cache is None:
+        fitnesses = batch(invalid_ind)
+    else:
+        fitnesses = cache.evaluate(batch, invalid_ind)
     for ind, fit in zip(invalid_ind, fitnesses):
         ind.fitness.values = fit
+    return invalid_ind
 
-    if halloffame is not None:
-        halloffame.update(population)
 
-    record = stats.compile(population) if stats else {}
-    logbook.record(gen=0, nevals=len(invalid_ind), **record)
+def evolutionaryAlgorithm(population, toolbox, cxpb, mutpb, ngen, stats=None,halloffame=None, verbose=__debug__,
+                          cache=None, instrument=None, checkpoint=None, logbook=None):
+    # Without instrumentation the phases are not timed
+    phase = instrument.phase if instrument is not None else _untimed
+
+    # Resume from the checkpoint if there is one
+    restored = checkpoint.load(population, halloffame, cache) if checkpoint is not None else None
+    if restored is not None:
+        start, restored_logbook = restored
+        if logbook is not None:
+            restored_logbook.sink, restored_logbook.maxlen = logbook.sink, logbook.maxlen
+        logbook = restored_logbook
+    else:
+        start = 0
+        if logbook is None:
+            logbook = support.LogStats()
+        logbook.header = ['gen', 'nevals'] + (['hits', 'misses'] if cache is not None else []) + \
+            (['inherited'] if hasattr(toolbox, "inherit") else []) + (stats.fields if stats else [])
+
+        # Evaluate the individuals with an invalid fitness
+        with phase("evaluate"):
+            invalid_ind = evaluation(population, toolbox, cache)
+        counters = cache.flush() if cache is not None else {}
+        if hasattr(toolbox, "inherit"):
+            counters["inherited"] = 0
+
+        if halloffame is not None:
+            with phase("halloffame"):
+                halloffame.update(population)
+
+        with phase("stats"):
+            record = stats.compile(population) if stats else {}
+        record.update(counters)
+        if instrument is not None:
+            record["timing"] = _flush(instrument, 0, population, invalid_ind)
+        logbook.record(gen=0, nevals=len(invalid_ind), **record)
+        if checkpoint is not None:
+            checkpoint.save(0, population, halloffame, logbook, cache)
+
     # Begin the generational process
-    for gen in range(1, ngen + 1):
+    for gen in range(start + 1, ngen + 1):
         # Select the next generation individuals
-        offspring = toolbox.select(population, len(population))
+        with phase("select"):
+            parents = toolbox.select(population, len(population))
         # Vary the pool of individuals
-        offspring = variation(offspring, toolbox, cxpb, mutpb)
+        with phase("variation"):
+            offspring = variation(parents, toolbox, cxpb, mutpb)
+
+        # Offspring only changed in code their parent never ran keep its
+        # fitness
+        counters = {}
+        if hasattr(toolbox, "inherit"):
+            with phase("inherit"):
+                counters["inherited"] = toolbox.inherit(parents, offspring)
+            if instrument is not None:
+                instrument.count("inherited", counters["inherited"])
 
         # Evaluate the individuals with an invalid fitness
-        invalid_ind = [ind for ind in offspring if not ind.fitness.valid]
-        fitnesses = toolbox.map(toolbox.evaluate, invalid_ind)
-        for ind, fit in zip(invalid_ind, fitnesses):
-            ind.fitness.values = fit
+        with phase("evaluate"):
+            invalid_ind = evaluation(offspring, toolbox, cache)
+        counters.update(cache.flush() if cache is not None else {})
 
         # Update the hall of fame with the generated individuals
         if halloffame is not None:
-            halloffame.update(offspring)
+            with phase("halloffame"):
+                halloffame.update(offspring)
 
         # Replace the current population by the offspring
         population[:] = offspring
 
         # Append the current generation statistics to the logbook
-        record = stats.compile(population) if stats else {}
+        with phase("stats"):
+            record = stats.compile(population) if stats else {}
+        record.update(counters)
+        if instrument is not None:
+            record["timing"] = _flush(instrument, gen, population, invalid_ind)
         logbook.record(gen=gen, nevals=len(invalid_ind), **record)
+        if checkpoint is not None:
+            with phase("checkpoint"):
+                checkpoint.save(gen, population, halloffame, logbook, cache)
+
+    if checkpoint is not None:
+        checkpoint.wait()
     return population, logbook
+
+
+def steadyStateAlgorithm(population, toolbox, cxpb, mutpb, nevals, inflight, stats=None, halloffame=None,
+                         freq=None, tournsize=7):
+    """Asynchronous steady state evolution without generations. Up to
+    *inflight* offspring are evaluated at once through ``toolbox.submit``,
+    which returns a :class:`concurrent.futures.Future` of the fitness, or
+    one at a time through ``toolbox.evaluate`` when the toolbox has no
+    submit function. As soon as an evaluation finishes the offspring
+    replaces the worst of *tournsize* random individuals and a new offspring
+    bred with ``toolbox.select``, ``toolbox.mate`` and ``toolbox.mutate``
+    takes its place, until *nevals* offspring were produced. Offspring left
+    unchanged by the variation keep the fitness of their parent and take
+    their place right away without being evaluated, the others are passed
+    to ``toolbox.simplify`` before their submission when the toolbox has
+    one. The logbook gets a record every *freq* offspring, one per
+    population size by default.
+    """
+    submit = getattr(toolbox, "submit", partial(_submitNow, toolbox))
+    freq = freq or len(population)
+    logbook = support.LogStats()
+    logbook.header = ['evals'] + (stats.fields if stats else [])
+
+    simplify = getattr(toolbox, "simplify", None)
+    invalid_ind = [ind for ind in population if not ind.fitness.valid]
+    if simplify is not None:
+        for ind in invalid_ind:
+            simplify(ind)
+    for ind, future in [(ind, submit(toolbox.evaluate, ind)) for ind in invalid_ind]:
+        ind.fitness.values = future.result()
+    if halloffame is not None:
+        halloffame.update(population)
+    record = stats.compile(population) if stats else {}
+    logbook.record(evals=0, **record)
+
+    pending = dict()
+    ready = []
+    evals = 0
+    submitted = 0
+    while evals < nevals:
+        while len(pending) < inflight and submitted < nevals:
+            child = _breed(population, toolbox, cxpb, mutpb)
+            if child.fitness.valid:
+                ready.append(child)
+            else:
+                if simplify is not None:
+                    simplify(child)
+                pending[submit(toolbox.evaluate, child)] = child
+            submitted += 1
+
+        if not ready:
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for future in done:
+                child = pending.pop(future)
+                child.fitness.values = future.result()
+                ready.append(child)
+        for child in ready:
+            aspirants = [random.randrange(len(population)) for _ in range(tournsize)]
+            loser = min(aspirants, key=lambda i: population[i].fitness)
+            population[loser] = child
+            if halloffame is not None:
+                halloffame.update([child])
+            evals += 1
+            if evals % freq == 0 or evals == nevals:
+                record = stats.compile(population) if stats else {}
+                logbook.record(evals=evals, **record)
+        ready = []
+    return population, logbook
+
+
+def _breed(population, toolbox, cxpb, mutpb):
+    parents = [toolbox.clone(ind) for ind in toolbox.select(population, 2)]
+    child = parents[0]
+    if random.random() < cxpb:
+        child, _ = toolbox.mate(parents[0], parents[1])
+        del child.fitness.values
+    if random.random() < mutpb:
+        child, = toolbox.mutate(child)
+        del child.fitness.values
+    return child
+
+
+def _submitNow(toolbox, evaluate, individual):
+    future = Future()
+    future.set_result(evaluate(individual))
+    return future
+
+
+def _untimed(name):
+    return nullcontext()
+
+
+def _flush(instrument, gen, population, invalid_ind):
+    instrument.count("evals", len(invalid_ind))
+    instrument.peak("size", max(len(ind) for ind in population))
+    return instrument.flush(gen)
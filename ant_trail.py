@@ -1,16 +1,22 @@
+import argparse
 import copy
+import os
 import random
 
 import numpy as np
 
+from array import array
+from collections import OrderedDict
 from functools import partial
 from operator import attrgetter
 import algorithms
 import base
+import checkpoint
 import creator
 import support
 import gp
-import matplotlib.pyplot as plt
+import parallel
+import trails
 def Tournament(individuals, k, tournsize, fit_attr="fitness"):
     chosen = []
     for i in range(k):
@@ -19,6 +25,32 @@ def Tournament(individuals, k, tournsize, fit_attr="fitness"):
     return chosen
 
 
+def TournamentParsimony(individuals, k, tournsize, fit_attr="fitness"):
+    """Select *k* individuals like :func:`Tournament`, the smallest of the
+    fittest aspirants winning the tournament. This lexicographic parsimony
+    pressure only favors small trees among equally fit ones.
+    """
+    chosen = []
+    for i in range(k):
+        aspirants = [random.choice(individuals) for i in range(tournsize)]
+        chosen.append(max(aspirants, key=lambda ind: (getattr(ind, fit_attr), -len(ind))))
+    return chosen
+
+
+def TournamentVectorized(individuals, k, tournsize, fit_attr="fitness"):
+    """Select *k* individuals with the distribution of :func:`Tournament`,
+    drawing all the aspirants at once with NumPy. Individuals are ranked on
+    their weighted fitness, equal fitnesses sharing a rank, so the first of
+    the best aspirants wins as with :func:`max`.
+    """
+    wvalues = np.array([getattr(ind, fit_attr).wvalues for ind in individuals])
+    _, ranks = np.unique(wvalues, axis=0, return_inverse=True)
+    ranks = ranks.ravel()
+    aspirants = np.random.randint(len(individuals), size=(k, tournsize))
+    winners = aspirants[np.arange(k), ranks[aspirants].argmax(axis=1)]
+    return [individuals[i] for i in winners]
+
+
 def progn(*args):
     for arg in args:
         arg()
@@ -48,20 +80,37 @@ class AntSimulator(object):
     direction = ["north", "east", "south", "west"]
     dir_row = [1, 0, -1, 0]
     dir_col = [0, 1, 0, -1]
+    EMPTY, FOOD = 0, 1
 
-    def __init__(self, max_moves):
+    def __init__(self, max_moves, max_worlds=16):
         self.max_moves = max_moves
+        self.max_worlds = max_worlds
         self.moves = 0
         self.eaten = 0
         self.routine = None
+        self.eaten_cells = []
+        self.saved = 0
+        self.worlds = OrderedDict()
+        self.skipped = 0
 
     def _reset(self):
-        self.row = self.row_start
-        self.col = self.col_start
+        self.cell = self.cell_start
         self.dir = 1
         self.moves = 0
         self.eaten = 0
-        self.matrix_exc = copy.deepcopy(self.matrix)
+        # Put back the food eaten during the last run
+        grid = self.grid
+        for cell in self.eaten_cells:
+            grid[cell] = self.FOOD
+        del self.eaten_cells[:]
+
+    @property
+    def row(self):
+        return self.cell // self.matrix_col
+
+    @property
+    def col(self):
+        return self.cell % self.matrix_col
 
     @property
     def position(self):
@@ -70,52 +119,318 @@ class AntSimulator(object):
     def turnleft(self):
         if self.moves < self.max_moves:
             self.moves += 1
-            self.dir = (self.dir - 1) % 4
+            self.dir = (self.dir - 1) & 3
 
     def turnright(self):
         if self.moves < self.max_moves:
             self.moves += 1
-            self.dir = (self.dir + 1) % 4
+            self.dir = (self.dir + 1) & 3
 
     def moveforward(self):
         if self.moves < self.max_moves:
             self.moves += 1
-            self.row = (self.row + self.dir_row[self.dir]) % self.matrix_row
-            self.col = (self.col + self.dir_col[self.dir]) % self.matrix_col
-            if self.matrix_exc[self.row][self.col] == "food":
+            self.cell = cell = self.ahead[self.dir][self.cell]
+            if self.grid[cell] == self.FOOD:
                 self.eaten += 1
-            self.matrix_exc[self.row][self.col] = "passed"
+                self.grid[cell] = self.EMPTY
+                self.eaten_cells.append(cell)
 
     def sense_food(self):
-        ahead_row = (self.row + self.dir_row[self.dir]) % self.matrix_row
-        ahead_col = (self.col + self.dir_col[self.dir]) % self.matrix_col
-        return self.matrix_exc[ahead_row][ahead_col] == "food"
+        return self.grid[self.ahead[self.dir][self.cell]] == self.FOOD
 
     def if_food_ahead(self, out1, out2):
         return partial(if_then_else, self.sense_food, out1, out2)
 
-    def run(self, routine):
+    def trace(self, index, func):
+        return partial(self.execute, index, func)
+
+    def execute(self, index, func):
+        # Nodes running out of moves can not change the run
+        if self.moves < self.max_moves and not self.first[index]:
+            self.first[index] = self.calls
+            self.fresh = True
+        return func()
+
+    def run(self, routine, coverage=None):
+        """Run *routine* until the ant is out of moves. As the routine is
+        deterministic, the run stops as soon as all the food is eaten or the
+        ant comes back to the position and direction it started a routine
+        call with, without eating in between. The remaining moves are then
+        charged at once and counted in :attr:`saved`.
+
+        Routines compiled with :meth:`trace` as wrapper record their run in
+        the :class:`Coverage` *coverage*. When it already holds snapshots,
+        the run resumes from the last one and the moves made before it are
+        counted in :attr:`skipped`.
+        """
         self._reset()
+        if coverage is not None:
+            self._record(routine, coverage)
+        else:
+            seen = set()
+            eaten = 0
+            while self.moves < self.max_moves:
+                if self.eaten != eaten:
+                    if self.eaten == self.food_count:
+                        break
+                    seen.clear()
+                    eaten = self.eaten
+                state = (self.cell, self.dir)
+                if state in seen:
+                    break
+                seen.add(state)
+                routine()
+        self.saved += self.max_moves - self.moves
+        self.moves = self.max_moves
+
+    def _record(self, routine, coverage):
+        snapshots = coverage.snapshots
+        self.first = coverage.first
+        self.calls = 0
+        self.fresh = True
+        if snapshots:
+            self.calls, self.cell, self.dir, self.moves, self.eaten, _ = snapshots[-1]
+            grid = self.grid
+            for cell in coverage.eaten:
+                grid[cell] = self.EMPTY
+            self.eaten_cells.extend(coverage.eaten)
+            self.skipped += self.moves
+            self.fresh = False
+
+        seen = set()
+        eaten = self.eaten
         while self.moves < self.max_moves:
+            if self.eaten != eaten:
+                if self.eaten == self.food_count:
+                    break
+                seen.clear()
+                eaten = self.eaten
+            # Runs can resume where nothing was seen yet, a snapshot only
+            # replaces the previous one when no node ran for the first time
+            # in between
+            if not seen:
+                snapshot = (self.calls, self.cell, self.dir, self.moves, self.eaten, len(self.eaten_cells))
+                if self.fresh or not snapshots:
+                    snapshots.append(snapshot)
+                else:
+                    snapshots[-1] = snapshot
+                self.fresh = False
+            state = (self.cell, self.dir)
+            if state in seen:
+                break
+            seen.add(state)
+            self.calls += 1
             routine()
+        coverage.eaten = array("l", self.eaten_cells)
 
     def matrix_parse(self, matrix):
-        self.matrix = list()
-        for index, line in enumerate(matrix):
-            self.matrix.append(list())
-            for lIndex, lcol in enumerate(line):
-                if lcol == "#":
-                    self.matrix[-1].append("food")
-                elif lcol == ".":
-                    self.matrix[-1].append("empty")
-                elif lcol == "S":
-                    self.matrix[-1].append("empty")
-                    self.row_start = self.row = index
-                    self.col_start = self.col = lIndex
-                    self.dir = 1
-        self.matrix_row = len(self.matrix)
-        self.matrix_col = len(self.matrix[0])
-        self.matrix_exc = copy.deepcopy(self.matrix)
+        self.load(trails.Trail.parse("trail", matrix))
+
+    def load(self, trail):
+        """Run the ant on the :class:`trails.Trail` *trail*. The simulator
+        keeps its own copy of the grid of the last *max_worlds* trails it was
+        given, loading one of them again only switches to that copy.
+        """
+        if trail.key in self.worlds:
+            self.worlds.move_to_end(trail.key)
+        else:
+            self.worlds[trail.key] = (trail, bytearray(trail.grid), [], neighbours(trail.rows, trail.cols))
+            if len(self.worlds) > self.max_worlds:
+                self.worlds.popitem(last=False)
+        self.trail, self.grid, self.eaten_cells, self.ahead = self.worlds[trail.key]
+        self.matrix_row = trail.rows
+        self.matrix_col = trail.cols
+        self.row_start, self.col_start = trail.start
+        self.cell_start = self.cell = self.row_start * self.matrix_col + self.col_start
+        self.dir = 1
+        self.food = trail.grid
+        self.food_count = trail.food
+        self.trail_key = trail.key
+
+
+_neighbours = {}
+
+
+class Coverage(object):
+    """Record of the run of a program. ``first[i]`` is the routine call,
+    counted from one, in which node *i* first ran with moves left, or zero
+    when it never did. The snapshots hold the routine calls made, the
+    position, direction, moves and food eaten of the ant at the start of
+    some routine calls along with the length of :attr:`eaten`, the cells
+    eaten in order.
+    """
+    __slots__ = ("first", "snapshots", "eaten")
+
+    def __init__(self, first, snapshots=None, eaten=None):
+        self.first = first
+        self.snapshots = snapshots if snapshots is not None else []
+        self.eaten = eaten if eaten is not None else array("l")
+
+    @classmethod
+    def empty(cls, size):
+        return cls(array("I", bytes(4 * size)))
+
+    def replace(self, slice_, size):
+        """Return the coverage of the program where the subtree at *slice_*,
+        which never ran, is replaced by a subtree of *size* nodes.
+        """
+        first = self.first[:slice_.start] + array("I", bytes(4 * size)) + self.first[slice_.stop:]
+        return Coverage(first, list(self.snapshots), self.eaten)
+
+    def prefix(self, slice_, size):
+        """Return the coverage of the program where the subtree at *slice_*
+        is replaced by a subtree of *size* nodes, up to the last snapshot
+        taken before the subtree first ran. Runs resume from there.
+        """
+        call = self.first[slice_.start]
+        snapshots = [snapshot for snapshot in self.snapshots if snapshot[0] < call]
+        calls = snapshots[-1][0]
+        first = self.first[:slice_.start] + array("I", bytes(4 * size)) + self.first[slice_.stop:]
+        first = array("I", [value if value <= calls else 0 for value in first])
+        return Coverage(first, snapshots, self.eaten[:snapshots[-1][5]])
+
+    def __getitem__(self, index):
+        return self.first[index]
+
+    def __len__(self):
+        return len(self.first)
+
+
+def neighbours(rows, cols):
+    """Return the toroidal neighbour of every cell of a *rows* by *cols*
+    grid in each direction of :class:`AntSimulator`, shared by the trails of
+    the same size.
+    """
+    if (rows, cols) not in _neighbours:
+        _neighbours[rows, cols] = [array("l", [(row + drow) % rows * cols + (col + dcol) % cols
+                                               for row in range(rows) for col in range(cols)])
+                                   for drow, dcol in zip(AntSimulator.dir_row, AntSimulator.dir_col)]
+    return _neighbours[rows, cols]
+
+
+class BatchSimulator(object):
+    """Simulate the ants of a whole population in lockstep with NumPy. The
+    trees are flattened into opcode arrays where every action and sensor
+    node knows the node executed after it, each ant then follows its own
+    program counter over these arrays on its own copy of the food grid. As
+    every ant performs exactly one action per step, all of them run out of
+    moves together after ``max_moves`` steps. The grids of the ants take at
+    most *memory* bytes, larger populations are simulated in chunks.
+    """
+    FORWARD, LEFT, RIGHT, SENSE, PROG = range(5)
+    kinds = {"moveforward": FORWARD, "turnleft": LEFT, "turnright": RIGHT,
+             "if_food_ahead": SENSE, "prog2": PROG, "prog3": PROG}
+
+    def __init__(self, simulator, pset, memory=2 ** 26):
+        self.simulator = simulator
+        self.pset = pset
+        self.memory = memory
+        self.tables = {}
+        self.node_kinds = np.array([self.kinds[node.name] for node in pset.nodes], dtype=np.int8)
+        self.node_arities = [node.arity for node in pset.nodes]
+
+    def flatten(self, individuals):
+        """Return the kind of each node of the concatenated *individuals*,
+        the first node each program executes, the node following each node
+        and, for the sensor nodes, the node executed when there is no food
+        ahead.
+        """
+        codes = np.concatenate([np.frombuffer(gp.encode(ind, self.pset), dtype=np.uint16)
+                                for ind in individuals])
+        kind = self.node_kinds[codes]
+        arity = [self.node_arities[code] for code in codes.tolist()]
+        size = len(codes)
+        end = [0] * size
+        succ = [0] * size
+        resolved = [0] * (size + 1)
+        starts = []
+        offset = 0
+        for ind in individuals:
+            stop = offset + len(ind)
+            # Subtree ends, children are found after their parent
+            ends = []
+            for i in range(stop - 1, offset - 1, -1):
+                for _ in range(arity[i]):
+                    end[i] = ends.pop()
+                if arity[i] == 0:
+                    end[i] = i + 1
+                ends.append(end[i])
+            # Node executed once a subtree is done, the root loops on itself
+            succ[offset] = offset
+            for i in range(offset, stop):
+                if arity[i] == 0:
+                    continue
+                child = i + 1
+                for _ in range(arity[i] - 1):
+                    succ[child] = end[child] if kind[i] == self.PROG else succ[i]
+                    child = end[child]
+                succ[child] = succ[i]
+            # Control nodes are skipped to their first child
+            for i in range(stop - 1, offset - 1, -1):
+                resolved[i] = resolved[i + 1] if kind[i] == self.PROG else i
+            starts.append(resolved[offset])
+            offset = stop
+
+        resolved = np.array(resolved[:size])
+        succ = resolved[succ]
+        orelse = np.zeros(size, dtype=resolved.dtype)
+        sense = np.nonzero(kind == self.SENSE)[0]
+        orelse[sense] = resolved[np.array(end)[sense + 1]]
+        succ[sense] = resolved[sense + 1]
+        return kind, np.array(starts), succ, orelse
+
+    def evaluate(self, individuals, trails=None):
+        """Return the fitness of every individual in *individuals*, the food
+        eaten on each trail of *trails* summed, or on the trail of the
+        simulator when no trail is given. The programs are flattened once for
+        all the trails.
+        """
+        if len(individuals) == 0:
+            return []
+        if trails is None:
+            trails = [self.simulator.trail]
+        kind, starts, succ, orelse = self.flatten(individuals)
+        eaten = np.zeros(len(individuals), dtype=np.intp)
+        for trail in trails:
+            # The ants get a copy of the grid each, bounded by self.memory
+            step = max(1, self.memory // (trail.rows * trail.cols))
+            for begin in range(0, len(individuals), step):
+                eaten[begin:begin + step] += self.simulate(trail, kind, starts[begin:begin + step], succ, orelse)
+        return [(int(value),) for value in eaten]
+
+    def simulate(self, trail, kind, pc, succ, orelse):
+        """Run the programs starting at the nodes *pc* on *trail* and return
+        the food eaten by each ant.
+        """
+        if (trail.rows, trail.cols) not in self.tables:
+            self.tables[trail.rows, trail.cols] = np.array(neighbours(trail.rows, trail.cols), dtype=np.intp).T
+        table = self.tables[trail.rows, trail.cols]
+        food = np.frombuffer(trail.grid, dtype=np.uint8)
+
+        size = len(pc)
+        pc = pc.copy()
+        ants = np.arange(size)
+        grid = np.tile(food, (size, 1))
+        cell = np.full(size, trail.start[0] * trail.cols + trail.start[1], dtype=np.intp)
+        dir_ = np.full(size, 1, dtype=np.intp)
+        eaten = np.zeros(size, dtype=np.intp)
+        for _ in range(self.simulator.max_moves):
+            # Follow the sensors until every ant reaches an action
+            sensing = np.nonzero(kind[pc] == self.SENSE)[0]
+            while len(sensing) > 0:
+                ahead = table[cell[sensing], dir_[sensing]]
+                current = pc[sensing]
+                pc[sensing] = np.where(grid[sensing, ahead], succ[current], orelse[current])
+                sensing = sensing[kind[pc[sensing]] == self.SENSE]
+
+            action = kind[pc]
+            cell = np.where(action == self.FORWARD, table[cell, dir_], cell)
+            # Ants that did not move stand on an empty cell
+            eaten += grid[ants, cell]
+            grid[ants, cell] = 0
+            dir_ = (dir_ + (action == self.RIGHT) - (action == self.LEFT)) % 4
+            pc = succ[pc]
+        return eaten
 
 
 ant_trail = AntSimulator(600)
@@ -130,8 +445,16 @@ pTree.terminalSet(ant_trail.turnright)
 
 creator.createClass("FitnessMax", base.Fitness, weights=(1.0,))
 creator.createClass("Individual", gp.Tree, fitness=creator.FitnessMax)
+# Individuals keeping the arrays of gp.ArrayTree, for the runs with arrays
+creator.createClass("ArrayIndividual", gp.ArrayTree, fitness=creator.FitnessMax, pset=pTree)
 
 toolbox = base.Toolkit()
+toolbox.register("clone", gp.clone)
+
+# Compiled routines only hold references to the simulator, so identical
+# trees can share them
+compiler = gp.CompileCache(maxsize=10000)
+tracer = gp.CompileCache(maxsize=10000, compiler=partial(gp.compileTree, wrap=ant_trail.trace))
 
 # Attribute generator
 toolbox.register("expr_init", gp.generationHalfAndHalf, pset=pTree, min_=1, max_=6)
@@ -141,40 +464,354 @@ toolbox.register("individual", initIterate, creator.Individual, toolbox.expr_ini
 toolbox.register("population", initRepeat, list, toolbox.individual)
 
 
-def evalSantaFeTrail(individual):
-    # Transform the tree expression to functionnal Python code
-    routine = gp.compile(individual, pTree)
-    # Run the generated routine
-    ant_trail.run(routine)
+def simplifyTree(expr, pset=pTree):
+    """Return the nodes of *expr* without the code that can not change the
+    run of the ant. A sensor whose result is already known, because no
+    action ran since the enclosing sensor, is replaced by the branch it
+    takes, a sensor with identical branches by that branch, and nested
+    progn are merged as long as the result fits in a prog2 or prog3.
+
+    Cancelling turns are kept: each of them is charged a move and removing
+    them would give the ant more moves than the original program.
+    """
+    sensor = pset.mapping["if_food_ahead"]
+    progs = {2: pset.mapping["prog2"], 3: pset.mapping["prog3"]}
+
+    def reduce(begin, known):
+        # Return the reduced subtree starting at begin as (node, children),
+        # known is the sensor result when the subtree starts or None
+        node = expr[begin]
+        if node.arity == 0:
+            return node, []
+        children = []
+        child = begin + 1
+        for _ in range(node.arity):
+            children.append(child)
+            child = expr.searchSubtree(child).stop
+
+        if node is sensor:
+            if known is not None:
+                return reduce(children[0] if known else children[1], known)
+            then_, orelse = reduce(children[0], True), reduce(children[1], False)
+            if gp.treeKey(serialize(then_)) == gp.treeKey(serialize(orelse)):
+                return then_
+            return node, [then_, orelse]
+
+        # The first child runs with the sensor state of its parent, any
+        # child afterward runs after at least one action
+        items = [reduce(children[0], known)] + [reduce(child, None) for child in children[1:]]
+        merged = True
+        while merged:
+            merged = False
+            for i, (child, grandchildren) in enumerate(items):
+                if child.name in ("prog2", "prog3") and len(items) + len(grandchildren) - 1 <= 3:
+                    items[i:i + 1] = grandchildren
+                    merged = True
+                    break
+        return progs[len(items)], items
+
+    def serialize(subtree):
+        node, children = subtree
+        nodes = [node]
+        for child in children:
+            nodes.extend(serialize(child))
+        return nodes
+
+    return serialize(reduce(0, None))
+
+
+def simplifyIndividual(individual):
+    """Replace the nodes of *individual* by its simplified program to keep
+    bloat down. Registered as the toolbox ``simplify`` function, it runs in
+    the main process before the evaluation so that the change is kept with a
+    process pool or remote workers and the cache sees the simplified tree.
+    """
+    nodes = simplifyTree(individual)
+    if len(nodes) < len(individual):
+        individual[0:len(individual)] = nodes
+        # The coverage of the parent no longer matches the nodes
+        individual.resume = None
+    return individual
+
+
+def evalSantaFeTrail(individual, simplify=False, instrument=None, coverage=False, resume=False):
+    # Simulations run on the simplified program, the individual keeping its
+    # own nodes (see simplifyIndividual to replace them)
+    if simplify:
+        individual = gp.Tree(simplifyTree(individual))
+    # The run is recorded in the individual's coverage, unless the program
+    # simulated is not the individual's, and resumes from the coverage of
+    # the parent before the changed subtree when there is one
+    record = None
+    if (coverage or resume) and not simplify:
+        record = getattr(individual, "resume", None) if resume else None
+        if record is None:
+            record = Coverage.empty(len(individual))
+    compile_ = tracer if record is not None else compiler
+    if instrument is None:
+        # Transform the tree expression to functionnal Python code
+        routine = compile_(individual, pTree)
+        # Run the generated routine
+        ant_trail.run(routine, record)
+    else:
+        with instrument.phase("compile"):
+            routine = compile_(individual, pTree)
+        saved, skipped = ant_trail.saved, ant_trail.skipped
+        with instrument.phase("simulate"):
+            ant_trail.run(routine, record)
+        skipped = ant_trail.skipped - skipped
+        instrument.count("moves", ant_trail.max_moves - (ant_trail.saved - saved) - skipped)
+        instrument.count("saved", ant_trail.saved - saved)
+        instrument.count("skipped", skipped)
+    if record is not None:
+        individual.coverage = record
+        individual.resume = None
     return ant_trail.eaten,
 
 
+def evalTrails(individual, trails):
+    """Return the food eaten by *individual* summed over *trails*, the
+    simulator being back on its own trail afterward.
+    """
+    routine = compiler(individual, pTree)
+    current = ant_trail.trail
+    eaten = 0
+    try:
+        for trail in trails:
+            ant_trail.load(trail)
+            ant_trail.run(routine)
+            eaten += ant_trail.eaten
+    finally:
+        ant_trail.load(current)
+    return eaten,
+
+
 toolbox.register("evaluate", evalSantaFeTrail)
+batch_trail = BatchSimulator(ant_trail, pTree)
+
+# Fitness only depends on the tree and the trail it runs on
+evalcache = support.EvaluationCache(100000, key=lambda ind: (ant_trail.trail_key, gp.treeKey(ind)))
 toolbox.register("select", Tournament, tournsize=7)
 toolbox.register("mate", gp.onepointcrossover)
 toolbox.register("expr_mut", gp.generationHalfAndHalf, min_=0, max_=6)
 toolbox.register("mutate", gp.uniformmutation, expr=toolbox.expr_mut, pset=pTree)
 
 
-def run_santa_fe_trail():
-    random.seed(69)
+# Trails parsed or generated once, evolutions on several trails select theirs
+registry = trails.TrailRegistry()
+
+
+def setupWorker(trail_path):
+    """Parse the trail in a worker process and return the primitive set the
+    individuals sent to the worker are decoded against. Trail files written
+    by :meth:`trails.Trail.save` are memory mapped instead.
+    """
+    if trail_path.endswith(".trail"):
+        ant_trail.load(trails.Trail.load(trail_path))
+    else:
+        with open(trail_path) as trail_file:
+            ant_trail.matrix_parse(trail_file)
+    return pTree
+
+
+def setupRemote(*paths):
+    """Load the trails of *paths* in a remote worker, each one named after
+    its file, and return the primitive set and the evaluation of the
+    individuals sent to the worker.
+    """
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        if path.endswith(".trail"):
+            registry.add(trails.Trail.load(path, name))
+        else:
+            registry.parse(name, path)
+    return pTree, evalRemote
+
+
+def evalRemote(individuals, key):
+    ant_trail.load(registry[key])
+    return [evalSantaFeTrail(ind) for ind in individuals]
 
-    with  open("santa-fe-trail.txt") as trail_file:
-        ant_trail.matrix_parse(trail_file)
 
-    population = toolbox.population(n=500)
-    hof = support.HallOfFame(1)
-    stats = support.registerfitness(lambda ind: ind.fitness.values)
+def fitnessStats():
+    stats = support.registerfitness(fitnessValues)
     stats.register("avg", np.mean)
     stats.register("min", np.min)
     stats.register("max", np.max)
+    return stats
 
-    _, logbook = algorithms.evolutionaryAlgorithm(population, toolbox, 0.9, 0.1, 50, stats, halloffame=hof)
+
+def fitnessValues(ind):
+    return ind.fitness.values
+
+
+def setupIsland(trail_path):
+    """Parse the trail in an island process and return the toolbox,
+    primitive set and statistics of the island.
+    """
+    setupWorker(trail_path)
+    return toolbox, pTree, fitnessStats()
+
+
+def runToolbox():
+    """Return a copy of the module toolbox for a run to register its own
+    functions in, the module toolbox keeping the ones of its callers.
+    """
+    return copy.copy(toolbox)
+
+
+def run_santa_fe_islands(nislands=4, size=125, freq=5, migrants=5, topology="ring"):
+    """Evolve the 500 individuals of :func:`run_santa_fe_trail` as
+    *nislands* islands of *size* individuals exchanging their *migrants*
+    best individuals every *freq* generations.
+    """
+    with open("santa-fe-trail.txt") as trail_file:
+        ant_trail.matrix_parse(trail_file)
+    # Serial runs do not load the island processes, islands is only imported here
+    import islands
+
+    hof = support.HallOfFame(1, clone=gp.clone)
+    logbook = islands.islandAlgorithm(setupIsland, ("santa-fe-trail.txt",), pTree, creator.Individual,
+                                      nislands, size, 0.9, 0.1, 50, freq, migrants, topology, fitnessStats(),
+                                      hof, seed=69)
+    return logbook, hof
+
+
+def run_santa_fe_steady_state(processes=None, nevals=25000):
+    """Evolve 500 individuals with the asynchronous steady state algorithm,
+    keeping *processes* workers busy.
+    """
+    random.seed(69)
+    np.random.seed(69)
+    with open("santa-fe-trail.txt") as trail_file:
+        ant_trail.matrix_parse(trail_file)
+
+    run_toolbox = runToolbox()
+    population = run_toolbox.population(n=500)
+    hof = support.HallOfFame(1, clone=gp.clone)
+    with parallel.ProcessPool(pTree, setupWorker, ("santa-fe-trail.txt",), processes) as pool:
+        run_toolbox.register("submit", pool.submit)
+        _, logbook = algorithms.steadyStateAlgorithm(population, run_toolbox, 0.9, 0.1, nevals, 2 * pool.processes,
+                                                     fitnessStats(), halloffame=hof)
+    return logbook, hof
+
+
+def run_santa_fe_generalization(size=512, count=3, batch=True):
+    """Evolve 500 individuals on the Santa Fe trail and *count* generated
+    trails of *size* by *size* cells, the fitness being the food eaten on
+    all of them.
+    """
+    random.seed(69)
+    np.random.seed(69)
+    if "santa-fe" not in registry:
+        registry.parse("santa-fe", "santa-fe-trail.txt")
+    names = ["santa-fe"]
+    for i in range(count):
+        name = "generated-{}-{}".format(size, i)
+        if name not in registry:
+            registry.generate(name, size, size, seed=i)
+        names.append(name)
+    ant_trail.load(registry["santa-fe"])
+
+    selected = registry.select(names)
+    run_toolbox = runToolbox()
+    run_toolbox.register("evaluate", evalTrails, trails=selected)
+    if batch:
+        run_toolbox.register("evaluate_population", batch_trail.evaluate, trails=selected)
+    population = run_toolbox.population(n=500)
+    hof = support.HallOfFame(1, clone=gp.clone)
+    _, logbook = algorithms.evolutionaryAlgorithm(population, run_toolbox, 0.9, 0.1, 50, fitnessStats(),
+                                                  halloffame=hof)
+    return logbook, hof
+
+
+def run_santa_fe_trail(cache=False, processes=None, batch=False, instrument=None, vectorized=False,
+                       checkpoint_path=None, logbook=None, inherit=False, resume=False, max_height=None,
+                       max_size=None, parsimony=False, bulk=False, workers=None, arrays=False,
+                       simplify=False):
+    random.seed(69)
+    np.random.seed(69)
+
+    with  open("santa-fe-trail.txt") as trail_file:
+        ant_trail.matrix_parse(trail_file)
+
+    # The run changes its own copy of the toolbox
+    run_toolbox = runToolbox()
+    individual = creator.ArrayIndividual if arrays else creator.Individual
+    if arrays:
+        run_toolbox.register("individual", initIterate, individual, run_toolbox.expr_init)
+        run_toolbox.register("population", initRepeat, list, run_toolbox.individual)
+    pool = client = None
+    try:
+        if processes is not None:
+            pool = parallel.ProcessPool(pTree, setupWorker, ("santa-fe-trail.txt",), processes)
+            run_toolbox.register("map", pool.map)
+        if workers is not None:
+            # Remote workers started with setupRemote on santa-fe-trail.txt, the
+            # asyncio client being only imported by the runs using it. They
+            # only run the plain evaluation, not the one of instrumented or
+            # inheriting runs.
+            import remote
+
+            client = remote.RemoteMap(workers, pTree, "santa-fe-trail", evaluate=toolbox.evaluate)
+            run_toolbox.register("map", client)
+        if batch:
+            run_toolbox.register("evaluate_population", batch_trail.evaluate)
+        if instrument is not None or inherit or resume:
+            run_toolbox.register("evaluate", evalSantaFeTrail, instrument=instrument, coverage=inherit,
+                                 resume=resume)
+        if inherit or resume:
+            run_toolbox.register("inherit", algorithms.inheritFitness)
+        if simplify:
+            run_toolbox.register("simplify", simplifyIndividual)
+        if vectorized:
+            run_toolbox.register("select", TournamentVectorized, tournsize=7)
+        if parsimony:
+            run_toolbox.register("select", TournamentParsimony, tournsize=7)
+        if bulk:
+            # Trees are generated for the whole population at once and by the
+            # thousand for the mutations
+            run_toolbox.register("expr_mut", gp.BulkGenerator(pTree, 0, 6))
+            run_toolbox.register("mutate", gp.uniformmutation, expr=run_toolbox.expr_mut, pset=pTree)
+        # Offspring over the limits are replaced by their parent
+        limits = []
+        counter = partial(instrument.count, "rejected") if instrument is not None else None
+        if max_height is not None:
+            limits.append(gp.staticLimit(attrgetter("height"), max_height, counter))
+        if max_size is not None:
+            limits.append(gp.staticLimit(len, max_size, counter))
+        if limits:
+            run_toolbox.decorate("mate", *limits)
+            run_toolbox.decorate("mutate", *limits)
+
+        if bulk:
+            population = gp.populationHalfAndHalf(pTree, 500, 1, 6, individual)
+        else:
+            population = run_toolbox.population(n=500)
+        hof = support.HallOfFame(1, clone=gp.clone)
+        stats = fitnessStats()
+
+        # An existing checkpoint is resumed, the population above being replaced
+        checkpoints = None
+        if checkpoint_path is not None:
+            checkpoints = checkpoint.Checkpoint(checkpoint_path, pTree, individual)
+
+        _, logbook = algorithms.evolutionaryAlgorithm(population, run_toolbox, 0.9, 0.1, 50, stats,
+                                                      halloffame=hof, cache=evalcache if cache else None,
+                                                      instrument=instrument, checkpoint=checkpoints,
+                                                      logbook=logbook)
+    finally:
+        if pool is not None:
+            pool.close()
+        if client is not None:
+            client.close()
 
     return logbook
 
-if __name__ == "__main__":
-    fitness_stats = run_santa_fe_trail()
+def plotFitness(fitness_stats, output=None):
+    # Plotting is optional on headless nodes, matplotlib is only imported here
+    import matplotlib.pyplot as plt
+
     generations_x = [fitness_stats[val]['gen'] for val in range(len(fitness_stats))]
     fitness_y = [[fitness_stats[val]['min'], fitness_stats[val]['avg'], fitness_stats[val]['max']] for val in
                  range(len(fitness_stats))]
@@ -184,4 +821,29 @@ if __name__ == "__main__":
     plt.xlabel('Generations')
     plt.ylabel('Fitness')
     plt.title('Fitness across each generation')
-    plt.show()
\ No newline at end of file
+    if output is None:
+        plt.show()
+    else:
+        plt.savefig(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evolve an ant for the Santa Fe trail.")
+    parser.add_argument("--log", help="stream the logbook to this .jsonl or .csv file")
+    parser.add_argument("--tail", type=int, help="number of logbook records kept in memory")
+    parser.add_argument("--headless", action="store_true", help="do not plot the fitness")
+    parser.add_argument("--plot", metavar="LOG", help="only plot the logbook streamed to LOG")
+    parser.add_argument("--output", help="save the plot to this file instead of showing it")
+    args = parser.parse_args()
+
+    if args.plot is not None:
+        plotFitness(support.readStream(args.plot), args.output)
+    else:
+        sink = None
+        if args.log is not None:
+            sink = support.CSVSink(args.log) if args.log.endswith(".csv") else support.JSONLinesSink(args.log)
+        fitness_stats = run_santa_fe_trail(logbook=support.LogStats(sink, args.tail))
+        if sink is not None:
+            sink.close()
+        if not args.headless:
+            plotFitness(support.readStream(args.log) if args.log is not None else fitness_stats, args.output)
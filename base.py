@@ -21,6 +21,16 @@ class Toolkit(object):
 
         setattr(self, alias, pfunc)
 
+    def decorate(self, alias, *decorators):
+        """Replace the function registered as *alias* by its decoration with
+        *decorators*, keeping the arguments it was registered with.
+        """
+        pfunc = getattr(self, alias)
+        function, args, kargs = pfunc.func, pfunc.args, pfunc.keywords
+        for decorator in decorators:
+            function = decorator(function)
+        self.register(alias, function, *args, **kargs)
+
 
 class Fitness(object):
     weights = None
@@ -83,11 +93,14 @@ class Fitness(object):
     def __ne__(self, other):
         return not self.__eq__(other)
 
-    def __deepcopy__(self, memo):
-        copy_ = self.__class__()
+    def __copy__(self):
+        copy_ = self.__class__.__new__(self.__class__)
         copy_.wvalues = self.wvalues
         return copy_
 
+    def __deepcopy__(self, memo):
+        return self.__copy__()
+
     def __str__(self):
         return str(self.values if self.valid else tuple())
 
@@ -0,0 +1,331 @@
+"""Benchmarks of the genetic programming hot paths on the Santa Fe trail.
+
+Every stage is timed in isolation on fixed seed populations of controlled
+tree sizes, then a full generation of the evolutionary algorithm is timed
+end to end. The results are written as JSON and can be compared with a
+stored baseline, by default the committed ``benchmark_baseline.json``
+measured on the reference machine::
+
+    python benchmark.py --output bench.json
+    python benchmark.py --baseline
+    python benchmark.py --baseline bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+import numpy as np
+
+import algorithms
+import ant_trail
+import creator
+import gp
+import support
+import trails
+
+TRAIL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "santa-fe-trail.txt")
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+# Ranges of tree heights of the benchmarked populations
+SIZES = {"small": (1, 4), "medium": (3, 6), "large": (5, 9)}
+
+# Generated trail of the large world benchmarks, built on first use
+LARGE_TRAIL = []
+
+BENCHMARKS = []
+
+
+def benchmark(name):
+    """Register the decorated function as the benchmark *name*. The function
+    receives a fixed seed population and returns a callable performing the
+    timed work along with the number of operations it performs.
+    """
+    def decorator(func):
+        BENCHMARKS.append((name, func))
+        return func
+    return decorator
+
+
+class Population(list):
+    size = None
+
+
+def population(size, n, seed):
+    random.seed(seed)
+    min_, max_ = SIZES[size]
+    return [creator.Individual(gp.generationHalfAndHalf(ant_trail.pTree, min_, max_))
+            for _ in range(n)]
+
+
+def evaluated(individuals):
+    for ind in individuals:
+        ind.fitness.values = ant_trail.evalSantaFeTrail(ind)
+    return individuals
+
+
+@benchmark("generate")
+def benchGenerate(individuals):
+    min_, max_ = SIZES[individuals.size]
+
+    def run():
+        for _ in range(len(individuals)):
+            gp.generationHalfAndHalf(ant_trail.pTree, min_, max_)
+    return run, len(individuals)
+
+
+@benchmark("generate_bulk")
+def benchGenerateBulk(individuals):
+    min_, max_ = SIZES[individuals.size]
+
+    def run():
+        gp.populationHalfAndHalf(ant_trail.pTree, len(individuals), min_, max_, creator.Individual)
+    return run, len(individuals)
+
+
+@benchmark("compile")
+def benchCompile(individuals):
+    def run():
+        for ind in individuals:
+            gp.compile(ind, ant_trail.pTree)
+    return run, len(individuals)
+
+
+@benchmark("compile_tree")
+def benchCompileTree(individuals):
+    def run():
+        for ind in individuals:
+            gp.compileTree(ind, ant_trail.pTree)
+    return run, len(individuals)
+
+
+@benchmark("simulate")
+def benchSimulate(individuals):
+    routines = [gp.compileTree(ind, ant_trail.pTree) for ind in individuals]
+
+    def run():
+        for routine in routines:
+            ant_trail.ant_trail.run(routine)
+    return run, len(individuals)
+
+
+@benchmark("simulate_batch")
+def benchSimulateBatch(individuals):
+    def run():
+        ant_trail.batch_trail.evaluate(individuals)
+    return run, len(individuals)
+
+
+def largeTrail():
+    if not LARGE_TRAIL:
+        LARGE_TRAIL.append(trails.generateTrail("large", 512, 512, seed=0))
+    return LARGE_TRAIL[0]
+
+
+@benchmark("simulate_large")
+def benchSimulateLarge(individuals):
+    trail = largeTrail()
+    # The simulator builds its grid and neighbour tables on the first run
+    ant_trail.evalTrails(individuals[0], [trail])
+
+    def run():
+        for ind in individuals:
+            ant_trail.evalTrails(ind, [trail])
+    return run, len(individuals)
+
+
+@benchmark("simulate_batch_large")
+def benchSimulateBatchLarge(individuals):
+    trail = largeTrail()
+    ant_trail.batch_trail.evaluate(individuals[:1], [trail])
+
+    def run():
+        ant_trail.batch_trail.evaluate(individuals, [trail])
+    return run, len(individuals)
+
+
+@benchmark("pack")
+def benchPack(individuals):
+    evaluated(individuals)
+
+    def run():
+        gp.unpackPopulation(gp.packPopulation(individuals, ant_trail.pTree), ant_trail.pTree, creator.Individual)
+    return run, len(individuals)
+
+
+@benchmark("crossover")
+def benchCrossover(individuals):
+    def run():
+        for ind1, ind2 in zip(individuals[::2], individuals[1::2]):
+            gp.onepointcrossover(ant_trail.toolbox.clone(ind1), ant_trail.toolbox.clone(ind2))
+    return run, len(individuals) // 2
+
+
+@benchmark("mutation")
+def benchMutation(individuals):
+    def run():
+        for ind in individuals:
+            ant_trail.toolbox.mutate(ant_trail.toolbox.clone(ind))
+    return run, len(individuals)
+
+
+@benchmark("crossover_array")
+def benchCrossoverArray(individuals):
+    individuals = [creator.ArrayIndividual(ind) for ind in individuals]
+
+    def run():
+        for ind1, ind2 in zip(individuals[::2], individuals[1::2]):
+            gp.onepointcrossover(ant_trail.toolbox.clone(ind1), ant_trail.toolbox.clone(ind2))
+    return run, len(individuals) // 2
+
+
+@benchmark("mutation_array")
+def benchMutationArray(individuals):
+    individuals = [creator.ArrayIndividual(ind) for ind in individuals]
+
+    def run():
+        for ind in individuals:
+            ant_trail.toolbox.mutate(ant_trail.toolbox.clone(ind))
+    return run, len(individuals)
+
+
+@benchmark("limit")
+def benchLimit(individuals):
+    # Height of the mutated offspring, as checked by the height limit
+    def run():
+        for ind in individuals:
+            ant_trail.toolbox.mutate(ant_trail.toolbox.clone(ind))[0].height
+    return run, len(individuals)
+
+
+@benchmark("limit_array")
+def benchLimitArray(individuals):
+    individuals = [creator.ArrayIndividual(ind) for ind in individuals]
+
+    def run():
+        for ind in individuals:
+            ant_trail.toolbox.mutate(ant_trail.toolbox.clone(ind))[0].height
+    return run, len(individuals)
+
+
+@benchmark("tournament")
+def benchTournament(individuals):
+    evaluated(individuals)
+
+    def run():
+        ant_trail.toolbox.select(individuals, len(individuals))
+    return run, len(individuals)
+
+
+@benchmark("halloffame")
+def benchHallOfFame(individuals):
+    evaluated(individuals)
+
+    def run():
+        support.HallOfFame(10, clone=gp.clone).update(individuals)
+    return run, len(individuals)
+
+
+@benchmark("generation")
+def benchGeneration(individuals):
+    evaluated(individuals)
+    stats = support.registerfitness(lambda ind: ind.fitness.values)
+    stats.register("avg", np.mean)
+    stats.register("min", np.min)
+    stats.register("max", np.max)
+
+    def run():
+        population = [ant_trail.toolbox.clone(ind) for ind in individuals]
+        hof = support.HallOfFame(1, clone=gp.clone)
+        algorithms.evolutionaryAlgorithm(population, ant_trail.toolbox, 0.9, 0.1, 1, stats, halloffame=hof)
+    return run, len(individuals)
+
+
+def measure(func, individuals, repeat):
+    """Return the best time over *repeat* runs of the benchmark *func*, the
+    random state is reset before each run so they all do the same work.
+    """
+    run, ops = func(individuals)
+    best = float("inf")
+    for _ in range(repeat):
+        random.seed(0)
+        np.random.seed(0)
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    return {"seconds": best, "ops": ops, "per_second": ops / best if best > 0 else float("inf")}
+
+
+def runAll(sizes, n, repeat, seed, names=None):
+    with open(TRAIL) as trail_file:
+        ant_trail.ant_trail.matrix_parse(trail_file)
+
+    results = {}
+    for size in sizes:
+        for name, func in BENCHMARKS:
+            if names and name not in names:
+                continue
+            individuals = Population(population(size, n, seed))
+            individuals.size = size
+            key = "{}/{}".format(name, size)
+            results[key] = measure(func, individuals, repeat)
+            results[key]["nodes"] = sum(len(ind) for ind in individuals)
+            print("{:<28} {:>12.6f} s {:>14.1f} ops/s".format(key, results[key]["seconds"],
+                                                            results[key]["per_second"]), file=sys.stderr)
+    return {"python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(),
+            "population": n, "repeat": repeat, "seed": seed, "results": results}
+
+
+def compare(results, baseline, tolerance):
+    """Print the speed of *results* relative to *baseline* and return the
+    names of the benchmarks slower than the baseline by more than
+    *tolerance*.
+    """
+    regressions = []
+    for key, result in sorted(results["results"].items()):
+        if key not in baseline["results"]:
+            continue
+        ratio = result["seconds"] / baseline["results"][key]["seconds"]
+        flag = ""
+        if ratio > 1 + tolerance:
+            regressions.append(key)
+            flag = "  REGRESSION"
+        print("{:<28} {:>8.3f}x{}".format(key, ratio, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", nargs="+", default=sorted(SIZES), choices=sorted(SIZES))
+    parser.add_argument("--only", nargs="+", choices=[name for name, _ in BENCHMARKS],
+                        help="run only these benchmarks")
+    parser.add_argument("-n", "--population", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=69)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", nargs="?", const=BASELINE,
+                        help="compare the results with this JSON file, the committed baseline when no file is given")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="relative slowdown reported as a regression")
+    args = parser.parse_args(argv)
+
+    results = runAll(args.sizes, args.population, args.repeat, args.seed, args.only)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(results, json.load(baseline), args.tolerance)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+import io
+import os
+import pickle
+import random
+import threading
+
+import numpy
+
+import gp
+
+
+class Checkpoint(object):
+    """Periodic checkpoint of an evolution in the single binary file *path*.
+    The population and the hall of fame are stored as buffers packed by
+    :func:`gp.packPopulation` against *pset*, the generation, the
+    logbook, the states of the :mod:`random` and NumPy generators, the
+    coverage of the individuals and the state of the evaluation cache are
+    pickled next to them. The *individual* class rebuilds the individuals on
+    :meth:`load`, restoring a checkpoint continues the evolution exactly as
+    it would have gone without interruption.
+
+    The state is captured every *freq* generations in the calling thread and
+    written in the background unless *background* is false, the file being
+    replaced atomically once completely written. An error of the background
+    write is raised by the next :meth:`save` or :meth:`wait`.
+    """
+
+    def __init__(self, path, pset, individual, freq=1, background=True):
+        self.path = path
+        self.pset = pset
+        self.individual = individual
+        self.freq = freq
+        self.background = background
+        self.writer = None
+        self.error = None
+
+    def save(self, gen, population, halloffame, logbook, cache=None):
+        if gen % self.freq != 0:
+            return
+        arrays = dict()
+        arrays["population"] = self._pack(population)
+        if halloffame is not None:
+            arrays["halloffame"] = self._pack(list(halloffame))
+        # Inheriting offspring need the coverage of their parents
+        coverage = [getattr(ind, "coverage", None) for ind in population]
+        cache_state = cache.getstate() if cache is not None else None
+        state = (gen, logbook, random.getstate(), numpy.random.get_state(), coverage, cache_state)
+        arrays["state"] = numpy.frombuffer(pickle.dumps(state, pickle.HIGHEST_PROTOCOL), dtype=numpy.uint8)
+
+        self.wait()
+        if self.background:
+            self.writer = threading.Thread(target=self._background, args=(arrays,))
+            self.writer.start()
+        else:
+            self._write(arrays)
+
+    def load(self, population, halloffame=None, cache=None):
+        """Replace the content of *population*, *halloffame* and *cache* by
+        the one of the checkpoint, restore the random generators and return
+        the generation and the logbook of the checkpoint, or None when there
+        is no checkpoint to resume from.
+        """
+        self.wait()
+        if not os.path.exists(self.path):
+            return None
+        with numpy.load(self.path) as arrays:
+            population[:] = self._unpack(arrays["population"])
+            if halloffame is not None and "halloffame" in arrays:
+                items = self._unpack(arrays["halloffame"])
+                # Inserting the worst first restores the order of equal members
+                halloffame.clear()
+                halloffame.update(items[::-1])
+            state = pickle.loads(arrays["state"].tobytes())
+        gen, logbook, random_state, numpy_state, coverage, cache_state = state
+        for ind, record in zip(population, coverage):
+            if record is not None:
+                ind.coverage = record
+        if cache is not None and cache_state is not None:
+            cache.setstate(cache_state)
+        random.setstate(random_state)
+        numpy.random.set_state(numpy_state)
+        return gen, logbook
+
+    def wait(self):
+        """Wait for the checkpoint being written, if any, and raise the
+        error of the write if it failed.
+        """
+        if self.writer is not None:
+            self.writer.join()
+            self.writer = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _pack(self, individuals):
+        return numpy.frombuffer(gp.packPopulation(individuals, self.pset), dtype=numpy.uint8)
+
+    def _unpack(self, packed):
+        return gp.unpackPopulation(packed.tobytes(), self.pset, self.individual)
+
+    def _background(self, arrays):
+        try:
+            self._write(arrays)
+        except Exception as error:
+            self.error = error
+
+    def _write(self, arrays):
+        buffer = io.BytesIO()
+        numpy.savez(buffer, **arrays)
+        temp = self.path + ".tmp"
+        with open(temp, "wb") as checkpoint_file:
+            checkpoint_file.write(buffer.getvalue())
+        os.replace(temp, self.path)
@@ -1,12 +1,18 @@
 import copy
 import random
 import re
+import struct
 import sys
 import warnings
+import zlib
 
-from collections import defaultdict, deque
+from array import array
+from collections import OrderedDict, defaultdict, deque
+from functools import partial, wraps
 from inspect import isclass
 
+import numpy
+
 __type__ = object
 
 
@@ -117,6 +123,106 @@ class Tree(list):
         return slice(begin, end)
 
 
+class ArrayTree(Tree):
+    """Tree keeping next to its nodes three integer arrays: the opcode of
+    each node in the class primitive set :attr:`pset`, the index where the
+    subtree of each node ends and the depth of each node. The arrays are
+    updated on every splice, which gives constant time subtree searches
+    and a cached height. Nodes are only changed by item assignment and
+    deletion, the other list mutators raise a :class:`TypeError`.
+    """
+    pset = None
+
+    def __init__(self, content):
+        if self.pset is None:
+            raise TypeError("{} has no primitive set, create it with a pset class attribute"
+                            .format(type(self).__name__))
+        Tree.__init__(self, content)
+        self.codes, self.ends, self.depths = _treeArrays(self, self.pset)
+        self._height = None
+
+    def __reduce__(self):
+        # Pickling appends the nodes one at a time by default
+        return self.__class__, (list(self),), self.__dict__
+
+    def __deepcopy__(self, memo):
+        new = self.__class__.__new__(self.__class__)
+        list.__init__(new, self)
+        new.__dict__.update(copy.deepcopy(self.__dict__, memo))
+        return new
+
+    def __setitem__(self, key, val):
+        if not isinstance(key, slice):
+            Tree.__setitem__(self, key, val)
+            self.codes = self.codes.copy()
+            self.codes[key] = self.pset.opcodes[val.name]
+            return
+
+        begin, end, _ = key.indices(len(self))
+        Tree.__setitem__(self, key, val)
+        codes, ends, depths = _treeArrays(val, self.pset, begin, self.depths[begin])
+        delta = len(val) - (end - begin)
+
+        # The ancestors of the spliced subtree and all the nodes following
+        # it see their subtree end move. The arrays are never written in
+        # place as clones share them.
+        head = self.ends[:begin] + (self.ends[:begin] >= end) * delta
+        self.codes = numpy.concatenate((self.codes[:begin], codes, self.codes[end:]))
+        self.ends = numpy.concatenate((head, ends, self.ends[end:] + delta))
+        self.depths = numpy.concatenate((self.depths[:begin], depths, self.depths[end:]))
+        self._height = None
+
+    def __delitem__(self, key):
+        if not isinstance(key, slice):
+            key = slice(key, key + 1) if key >= 0 else slice(len(self) + key, len(self) + key + 1)
+        begin, end, step = key.indices(len(self))
+        if step != 1:
+            self._unsupported()
+        list.__delitem__(self, key)
+        delta = begin - end
+        head = self.ends[:begin] + (self.ends[:begin] >= end) * delta
+        self.codes = numpy.concatenate((self.codes[:begin], self.codes[end:]))
+        self.ends = numpy.concatenate((head, self.ends[end:] + delta))
+        self.depths = numpy.concatenate((self.depths[:begin], self.depths[end:]))
+        self._height = None
+
+    def _unsupported(self, *args, **kargs):
+        raise TypeError("ArrayTree nodes are only changed by item assignment and deletion")
+
+    append = extend = insert = pop = remove = clear = reverse = sort = _unsupported
+    __iadd__ = __imul__ = _unsupported
+
+    @property
+    def height(self):
+        if self._height is None:
+            self._height = int(self.depths.max())
+        return self._height
+
+    def searchSubtree(self, begin):
+        return slice(begin, int(self.ends[begin]))
+
+
+def _treeArrays(nodes, pset, offset=0, depth=0):
+    """Return the opcodes, subtree ends and depths of the prefix ordered
+    *nodes*, as if the first node was at index *offset* and depth *depth*.
+    """
+    codes = numpy.array([pset.opcodes[node.name] for node in nodes], dtype=numpy.uint16)
+    ends = numpy.empty(len(nodes), dtype=numpy.intp)
+    depths = numpy.empty(len(nodes), dtype=numpy.intp)
+    stack = [depth]
+    for i, node in enumerate(nodes):
+        depths[i] = stack.pop()
+        stack.extend([depths[i] + 1] * node.arity)
+    stack = []
+    for i in range(len(nodes) - 1, -1, -1):
+        end = offset + i + 1
+        for _ in range(nodes[i].arity):
+            end = stack.pop()
+        ends[i] = end
+        stack.append(end)
+    return codes, ends, depths
+
+
 class Primitive(object):
     __slots__ = ('name', 'arity', 'args', 'ret', 'seq')
 
@@ -174,6 +280,8 @@ class PrimitiveSetTyped(object):
         self.arguments = []
         self.context = {"__builtins__": None}
         self.mapping = dict()
+        self.nodes = []
+        self.opcodes = dict()
         self.terms_count = 0
         self.prims_count = 0
 
@@ -196,7 +304,10 @@ class PrimitiveSetTyped(object):
                 self.arguments[i] = new_name
                 self.mapping[new_name] = self.mapping[old_name]
                 self.mapping[new_name].value = new_name
+                # Opcodes are looked up by node name, both follow the rename
+                self.mapping[new_name].name = new_name
                 del self.mapping[old_name]
+                self.opcodes[new_name] = self.opcodes.pop(old_name)
 
     def _add(self, prim):
         def addType(dict_, ret_type):
@@ -213,6 +324,8 @@ class PrimitiveSetTyped(object):
         addType(self.terminals, prim.ret)
 
         self.mapping[prim.name] = prim
+        self.opcodes[prim.name] = len(self.nodes)
+        self.nodes.append(prim)
         if isinstance(prim, Primitive):
             for type_ in prim.args:
                 addType(self.primitives, type_)
@@ -299,6 +412,224 @@ def compile(expr, pset):
         _, _, traceback = sys.exc_info()
 
 
+def treeKey(expr):
+    """Return a hashable key describing the structure of *expr*, two trees
+    with the same key compile to the same routine.
+    """
+    return tuple(node.name for node in expr)
+
+
+def clone(individual):
+    """Return a copy of *individual* for the variation operators. The nodes
+    are immutable and only referenced by the copy, the fitness is copied and
+    every other attribute is shared with *individual* until a splice
+    replaces it, as :class:`ArrayTree` does with its arrays.
+    """
+    new = individual.__class__.__new__(individual.__class__)
+    list.__init__(new, individual)
+    new.__dict__.update(individual.__dict__)
+    new.fitness = copy.copy(individual.fitness)
+    return new
+
+
+def changedSubtree(parent, child):
+    """Return the slice of the smallest subtree of *parent* whose
+    replacement gives *child*, along with the length of the subtree taking
+    its place in *child*, or None when both trees are identical. The
+    differences are found from the common prefix and suffix of the trees.
+    """
+    size = min(len(parent), len(child))
+    prefix = 0
+    while prefix < size and parent[prefix] is child[prefix]:
+        prefix += 1
+    if prefix == len(parent) == len(child):
+        return None
+    suffix = 0
+    while suffix < size - prefix and parent[-1 - suffix] is child[-1 - suffix]:
+        suffix += 1
+
+    # Deepest subtree spanning all the changed nodes whose counterpart in
+    # the child, between the same prefix and suffix, is a single subtree
+    stop = max(len(parent) - suffix, prefix + 1)
+    for begin in range(min(prefix, len(parent) - 1), -1, -1):
+        slice_ = parent.searchSubtree(begin)
+        size = len(child) - len(parent) + slice_.stop - slice_.start
+        if slice_.stop >= stop and child.searchSubtree(begin).stop == begin + size:
+            return slice_, size
+
+
+def encode(expr, pset):
+    """Return the nodes of *expr* as an array of the opcodes *pset* assigned
+    to them, opcodes follow the order in which nodes were added to the set.
+    """
+    opcodes = pset.opcodes
+    return array("H", [opcodes[node.name] for node in expr])
+
+
+def decode(codes, pset):
+    """Return the list of nodes encoded in *codes* by :func:`encode`."""
+    nodes = pset.nodes
+    return [nodes[code] for code in codes]
+
+
+# Header of the packed populations: magic, bytes per opcode, number of
+# fitness weights, checksum of the opcode table and number of trees
+_PACK_HEADER = struct.Struct("<4sBBII")
+_PACK_MAGIC = b"GPT1"
+
+
+def _signature(pset):
+    return zlib.crc32("\n".join(node.name for node in pset.nodes).encode())
+
+
+def packPopulation(individuals, pset):
+    """Pack *individuals* into a single buffer: a header, the length of
+    every tree as ``uint32``, their weighted fitness values as ``float64``,
+    NaN for an invalid fitness, and the opcodes of all the nodes as
+    ``uint8``, or ``uint16`` when *pset* holds more than 256 nodes. The
+    buffer can be sent to another process or written to a file as is.
+    """
+    width = 1 if len(pset.nodes) <= 256 else 2
+    fitnesses = [getattr(ind, "fitness", None) for ind in individuals]
+    nweights = len(fitnesses[0].weights) if fitnesses and fitnesses[0] is not None else 0
+    opcodes = pset.opcodes
+    codes = numpy.array([opcodes[node.name] for ind in individuals for node in ind],
+                        dtype=numpy.uint8 if width == 1 else numpy.uint16)
+    lengths = numpy.array([len(ind) for ind in individuals], dtype=numpy.uint32)
+    wvalues = numpy.array([fit.wvalues if fit.valid else (numpy.nan,) * nweights
+                           for fit in fitnesses] if nweights else [], dtype=numpy.float64)
+    header = _PACK_HEADER.pack(_PACK_MAGIC, width, nweights, _signature(pset), len(individuals))
+    return b"".join((header, lengths.tobytes(), wvalues.tobytes(), codes.tobytes()))
+
+
+def unpackPopulation(buffer, pset, cls=Tree):
+    """Return the trees packed in *buffer* by :func:`packPopulation` as
+    instances of *cls*, with their fitness when *cls* has one.
+    """
+    magic, width, nweights, signature, count = _PACK_HEADER.unpack_from(buffer)
+    if magic != _PACK_MAGIC:
+        raise ValueError("Not a packed population")
+    if signature != _signature(pset):
+        raise ValueError("Population packed against another primitive set")
+    offset = _PACK_HEADER.size
+    lengths = numpy.frombuffer(buffer, dtype=numpy.uint32, count=count, offset=offset)
+    offset += lengths.nbytes
+    wvalues = numpy.frombuffer(buffer, dtype=numpy.float64, count=count * nweights, offset=offset)
+    offset += wvalues.nbytes
+    codes = numpy.frombuffer(buffer, dtype=numpy.uint8 if width == 1 else numpy.uint16, offset=offset).tolist()
+
+    nodes = pset.nodes
+    individuals = []
+    start = 0
+    for i, length in enumerate(lengths.tolist()):
+        ind = cls([nodes[code] for code in codes[start:start + length]])
+        start += length
+        values = wvalues[i * nweights:(i + 1) * nweights]
+        if nweights and hasattr(ind, "fitness") and not numpy.isnan(values).any():
+            ind.fitness.wvalues = tuple(values.tolist())
+        individuals.append(ind)
+    return individuals
+
+
+def packTree(expr, pset):
+    """Pack the single tree *expr*, see :func:`packPopulation`."""
+    return packPopulation([expr], pset)
+
+
+def unpackTree(buffer, pset, cls=Tree):
+    return unpackPopulation(buffer, pset, cls)[0]
+
+
+def compileTree(expr, pset, wrap=None):
+    """Compile the prefix ordered *expr* straight into a callable, without
+    rendering it to a string and going through :func:`eval`. The tree is
+    walked once in reverse, each primitive being called with its already
+    compiled arguments exactly like the evaluated string would do. When
+    *wrap* is given, it is called with the index and the compiled value of
+    every node and returns the value used in its place.
+    """
+    context = pset.context
+    stack = []
+    if len(pset.arguments) == 0:
+        for index in reversed(range(len(expr))):
+            node = expr[index]
+            if isinstance(node, Primitive):
+                args = [stack.pop() for _ in range(node.arity)]
+                stack.append(context[node.name](*args))
+            elif node.conv_fct is str:
+                stack.append(context[node.value])
+            else:
+                stack.append(node.value)
+            if wrap is not None:
+                stack[-1] = wrap(index, stack[-1])
+        return stack[0]
+
+    # With arguments every node becomes a closure over the call arguments
+    arguments = dict((name, i) for i, name in enumerate(pset.arguments))
+    for index in reversed(range(len(expr))):
+        node = expr[index]
+        if isinstance(node, Primitive):
+            args = tuple(stack.pop() for _ in range(node.arity))
+            stack.append(partial(_callPrimitive, context[node.name], args))
+        elif node.conv_fct is str and node.value in arguments:
+            stack.append(partial(_getArgument, arguments[node.value]))
+        elif node.conv_fct is str:
+            stack.append(partial(_getValue, context[node.value]))
+        else:
+            stack.append(partial(_getValue, node.value))
+        if wrap is not None:
+            stack[-1] = wrap(index, stack[-1])
+    return stack[0]
+
+
+def _callPrimitive(primitive, args, *values):
+    return primitive(*[arg(*values) for arg in args])
+
+
+def _getArgument(index, *values):
+    return values[index]
+
+
+def _getValue(value, *values):
+    return value
+
+
+class CompileCache(object):
+    """Bounded least recently used cache of compiled trees. Trees are keyed
+    on their structure, so the clones made by the selection and variation
+    share a single compiled routine. The compiled routines must not hold
+    any state of their own for this sharing to be safe.
+    """
+
+    def __init__(self, maxsize=10000, compiler=compileTree):
+        self.maxsize = maxsize
+        self.compiler = compiler
+        self.routines = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, expr, pset):
+        key = (id(pset), treeKey(expr))
+        try:
+            routine = self.routines[key]
+        except KeyError:
+            self.misses += 1
+            routine = self.compiler(expr, pset)
+            self.routines[key] = routine
+            if len(self.routines) > self.maxsize:
+                self.routines.popitem(last=False)
+        else:
+            self.hits += 1
+            self.routines.move_to_end(key)
+        return routine
+
+    def clear(self):
+        self.routines.clear()
+
+    def __len__(self):
+        return len(self.routines)
+
+
 def generationGrow(pset, min_, max_, type_=None):
     def condition(height, depth):
         return depth == height or \
@@ -348,6 +679,143 @@ def generate(pset, min_, max_, condition, type_=None):
     return expr
 
 
+def generateBulk(pset, n, min_, max_, method="half", type_=None):
+    """Generate *n* trees at once with the distribution of
+    :func:`generationGrow` for the ``"grow"`` *method*,
+    :func:`generationFull` for ``"full"`` and :func:`generationHalfAndHalf`
+    for ``"half"``. The trees are built one depth level at a time for all
+    of them, every random number being drawn from the NumPy generator in
+    one array per level. Return the opcodes of *pset* of all the trees
+    concatenated in prefix order and the length of each tree.
+    """
+    if type_ is None:
+        type_ = pset.ret
+    # Candidate nodes of each type, padded to the same length
+    types = list(set(pset.terminals) | set(pset.primitives))
+    index = dict((t, i) for i, t in enumerate(types))
+    width = max(max(len(pset.terminals[t]), len(pset.primitives[t])) for t in types)
+    terminals = numpy.zeros((len(types), width), dtype=numpy.intp)
+    primitives = numpy.zeros((len(types), width), dtype=numpy.intp)
+    nterminals = numpy.zeros(len(types), dtype=numpy.intp)
+    nprimitives = numpy.zeros(len(types), dtype=numpy.intp)
+    for t, i in index.items():
+        nterminals[i] = len(pset.terminals[t])
+        nprimitives[i] = len(pset.primitives[t])
+        terminals[i, :nterminals[i]] = [pset.opcodes[node.name] for node in pset.terminals[t]]
+        primitives[i, :nprimitives[i]] = [pset.opcodes[node.name] for node in pset.primitives[t]]
+    arities = numpy.array([node.arity for node in pset.nodes], dtype=numpy.intp)
+    args = numpy.zeros((len(pset.nodes), max(arities.max(), 1)), dtype=numpy.intp)
+    for code, node in enumerate(pset.nodes):
+        if isinstance(node, Primitive):
+            args[code, :node.arity] = [index[arg] for arg in node.args]
+
+    heights = numpy.random.randint(min_, max_ + 1, size=n)
+    if method == "half":
+        grow = numpy.random.random_sample(n) < 0.5
+    else:
+        grow = numpy.full(n, method == "grow")
+    # Typed sets have no terminal ratio, only the grow method needs it
+    ratio = pset.terminalRatio if grow.any() else 0.0
+
+    # Nodes of each level with their tree, type, parent and argument slot
+    tree = numpy.arange(n)
+    types_ = numpy.full(n, index[type_], dtype=numpy.intp)
+    parent = numpy.full(n, -1, dtype=numpy.intp)
+    slot = numpy.zeros(n, dtype=numpy.intp)
+    levels = []
+    start = 0
+    depth = 0
+    while len(tree) > 0:
+        leaf = (depth == heights[tree]) | (nprimitives[types_] == 0)
+        leaf |= grow[tree] & (depth >= min_) & (numpy.random.random_sample(len(tree)) < ratio)
+        # A leaf of a type without terminals would never end its tree
+        missing = leaf & (nterminals[types_] == 0)
+        if missing.any():
+            raise IndexError("The gp.generateBulk function tried to add a terminal of type {}"
+                             .format(types[types_[missing][0]]))
+        draw = numpy.random.random_sample(len(tree))
+        codes = numpy.where(leaf, terminals[types_, (draw * nterminals[types_]).astype(numpy.intp)],
+                            primitives[types_, (draw * nprimitives[types_]).astype(numpy.intp)])
+        levels.append((start, codes, parent, slot))
+
+        arity = arities[codes]
+        nodes = numpy.repeat(numpy.arange(start, start + len(codes)), arity)
+        first = numpy.cumsum(arity) - arity
+        slot = numpy.arange(len(nodes)) - numpy.repeat(first, arity)
+        types_ = args[codes[nodes - start], slot]
+        tree = tree[nodes - start]
+        parent = nodes
+        start += len(codes)
+        depth += 1
+
+    # Subtree sizes bottom up, then prefix positions top down, the
+    # children of a node following each other in the level below it
+    size = numpy.ones(start, dtype=numpy.intp)
+    for begin, codes, parent, _ in reversed(levels[1:]):
+        numpy.add.at(size, parent, size[begin:begin + len(codes)])
+    lengths = size[:n]
+    position = numpy.zeros(start, dtype=numpy.intp)
+    position[:n] = numpy.cumsum(lengths) - lengths
+    for begin, codes, parent, slot in levels[1:]:
+        sizes = size[begin:begin + len(codes)]
+        before = numpy.cumsum(sizes) - sizes
+        local = numpy.arange(len(codes))
+        position[begin:begin + len(codes)] = position[parent] + 1 + before - before[local - slot]
+
+    result = numpy.empty(start, dtype=numpy.uint16)
+    result[position] = numpy.concatenate([codes for _, codes, _, _ in levels])
+    return result, lengths
+
+
+def populationHalfAndHalf(pset, n, min_, max_, cls=Tree, method="half"):
+    """Return *n* instances of *cls* built from the trees of
+    :func:`generateBulk`.
+    """
+    codes, lengths = generateBulk(pset, n, min_, max_, method)
+    return [cls(nodes) for nodes in _splitNodes(codes, lengths, pset)]
+
+
+def _splitNodes(codes, lengths, pset):
+    nodes = pset.nodes
+    # Ephemeral constants are instantiated for every node
+    ephemeral = any(isclass(node) for node in nodes)
+    codes = codes.tolist()
+    start = 0
+    for length in lengths.tolist():
+        expr = [nodes[code] for code in codes[start:start + length]]
+        if ephemeral:
+            expr = [node() if isclass(node) else node for node in expr]
+        yield expr
+        start += length
+
+
+class BulkGenerator(object):
+    """Drop-in replacement of :func:`generationHalfAndHalf` as the *expr*
+    of :func:`uniformmutation`, handing out trees generated *size* at a
+    time by :func:`generateBulk` for each type.
+    """
+
+    def __init__(self, pset, min_, max_, size=1000, method="half"):
+        self.pset = pset
+        self.min_ = min_
+        self.max_ = max_
+        self.size = size
+        self.method = method
+        self.pools = defaultdict(list)
+
+    def __call__(self, pset=None, type_=None):
+        pset = self.pset if pset is None else pset
+        if pset is not self.pset:
+            raise ValueError("BulkGenerator used with another primitive set")
+        type_ = pset.ret if type_ is None else type_
+        pool = self.pools[type_]
+        if not pool:
+            codes, lengths = generateBulk(pset, self.size, self.min_, self.max_, self.method, type_)
+            pool.extend(_splitNodes(codes, lengths, pset))
+            pool.reverse()
+        return pool.pop()
+
+
 def onepointcrossover(ind1, ind2):
     if len(ind1) < 2 or len(ind2) < 2:
         # No crossover on single node tree
@@ -388,3 +856,28 @@ def uniformmutation(individual, expr, pset):
     individual[slice_] = expr(pset=pset, type_=type_)
     return individual,
 
+
+## GP BLOAT CONTROL
+
+def staticLimit(key, max_value, counter=None):
+    """Decorate a variation operator so that each individual it returns
+    whose *key*, such as :func:`len` or the tree height, exceeds
+    *max_value* is replaced by a copy of the individual given at the same
+    position. The number of individuals replaced in a call is passed to
+    *counter* when given.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kargs):
+            parents = [clone(ind) for ind in args]
+            offspring = list(func(*args, **kargs))
+            rejected = 0
+            for i, ind in enumerate(offspring):
+                if key(ind) > max_value:
+                    offspring[i] = parents[i]
+                    rejected += 1
+            if counter is not None and rejected > 0:
+                counter(rejected)
+            return tuple(offspring)
+        return wrapper
+    return decorator
@@ -0,0 +1,140 @@
+import multiprocessing
+import random
+import traceback
+
+import numpy
+
+import algorithms
+import gp
+import support
+
+
+def _island(conn, setup, args, size, seed, cxpb, mutpb, migrants, hofsize):
+    try:
+        _evolveIsland(conn, setup, args, size, seed, cxpb, mutpb, migrants, hofsize)
+    except Exception:
+        # The traceback is raised again by the parent, which then stops the
+        # island
+        conn.send(traceback.format_exc())
+        try:
+            while conn.recv() is not None:
+                pass
+        except EOFError:
+            pass
+    conn.close()
+
+
+def _evolveIsland(conn, setup, args, size, seed, cxpb, mutpb, migrants, hofsize):
+    random.seed(seed)
+    numpy.random.seed(seed)
+    toolbox, pset, stats = setup(*args)
+    # The values of the statistics are sent for the parent to compute the
+    # statistics over all the islands
+    values = support.registerfitness(stats.key)
+    values.register("values", numpy.array)
+    population = toolbox.population(n=size)
+    individual = type(population[0])
+    halloffame = support.HallOfFame(hofsize, clone=toolbox.clone) if hofsize > 0 else None
+    epoch = 0
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        ngen, immigrants = message
+
+        # Immigrants take the place of the worst individuals, the island
+        # keeping its size when it receives more of them
+        immigrants = [ind for packed in immigrants for ind in gp.unpackPopulation(packed, pset, individual)]
+        immigrants = immigrants[:len(population)]
+        if immigrants:
+            population.sort(key=lambda ind: ind.fitness)
+            population[:len(immigrants)] = immigrants
+
+        _, logbook = algorithms.evolutionaryAlgorithm(population, toolbox, cxpb, mutpb, ngen, values,
+                                                      halloffame=halloffame)
+        # Generation 0 of the later epochs only accounts for the immigrants
+        records = list(logbook) if epoch == 0 else list(logbook[1:])
+        best = sorted(population, key=lambda ind: ind.fitness, reverse=True)[:migrants]
+        hof = list(halloffame) if halloffame is not None else []
+        conn.send((records, gp.packPopulation(best, pset), gp.packPopulation(hof, pset)))
+        epoch += 1
+
+
+def islandAlgorithm(setup, args, pset, individual, nislands, size, cxpb, mutpb, ngen, freq, migrants=1,
+                    topology="ring", stats=None, halloffame=None, seed=None):
+    """Evolve *nislands* populations of *size* individuals in as many
+    processes. Each process calls ``setup(*args)``, which returns the
+    toolbox, primitive set and statistics of its island, whose key gives
+    the values sent back for every generation, then runs
+    :func:`algorithms.evolutionaryAlgorithm` for *freq* generations at a
+    time. Between these epochs the *migrants* best individuals of each
+    island replace the worst ones of another island, the next island with
+    the ``"ring"`` *topology* or a random other island with ``"random"``.
+    Individuals travel in buffers packed by :func:`gp.packPopulation`
+    against *pset* and are rebuilt with the *individual* class.
+
+    Returns the logbook of the archipelago, the *stats* of each generation
+    being computed over the values of all the islands, and updates
+    *halloffame* with the best individuals of all the islands.
+    """
+    if topology not in ("ring", "random"):
+        raise ValueError("Unknown migration topology: {}".format(topology))
+    rng = random.Random(seed)
+    seeds = [rng.randrange(2 ** 32) for _ in range(nislands)]
+    hofsize = halloffame.maxsize if halloffame is not None else 0
+
+    connections = []
+    processes = []
+    for i in range(nislands):
+        parent, child = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=_island, args=(child, setup, args, size, seeds[i], cxpb,
+                                                                mutpb, migrants, hofsize))
+        process.start()
+        child.close()
+        connections.append(parent)
+        processes.append(process)
+
+    logbook = support.LogStats()
+    logbook.header = ['gen', 'nevals'] + (stats.fields if stats else [])
+    immigrants = [[] for _ in range(nislands)]
+    try:
+        done = 0
+        while done < ngen:
+            epoch = min(freq, ngen - done)
+            for conn, incoming in zip(connections, immigrants):
+                conn.send((epoch, incoming))
+            replies = [conn.recv() for conn in connections]
+            for i, reply in enumerate(replies):
+                if isinstance(reply, str):
+                    raise RuntimeError("Island {} failed:\n{}".format(i, reply))
+
+            for gen in range(len(replies[0][0])):
+                current = [records[gen] for records, _, _ in replies]
+                values = numpy.concatenate([island["values"] for island in current])
+                record = stats.compileValues(values) if stats else {}
+                logbook.record(gen=current[0]["gen"] + done, nevals=sum(island["nevals"] for island in current),
+                               **record)
+
+            if topology == "ring":
+                targets = [(i + 1) % nislands for i in range(nislands)]
+            else:
+                targets = [rng.choice([j for j in range(nislands) if j != i] or [i]) for i in range(nislands)]
+            immigrants = [[] for _ in range(nislands)]
+            for (_, emigrants, _), target in zip(replies, targets):
+                immigrants[target].append(emigrants)
+
+            if halloffame is not None:
+                for _, _, hof in replies:
+                    halloffame.update(gp.unpackPopulation(hof, pset, individual))
+            done += epoch
+    finally:
+        for conn in connections:
+            # An island killed on its own already closed its end
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            conn.close()
+        for process in processes:
+            process.join()
+    return logbook
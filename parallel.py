@@ -0,0 +1,65 @@
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import gp
+
+# Primitive set of the worker process, built once by the pool initializer
+_pset = None
+
+
+def _initWorker(setup, args):
+    global _pset
+    _pset = setup(*args)
+
+
+def _evaluate(evaluate, codes):
+    return evaluate(gp.Tree(gp.decode(codes, _pset)))
+
+
+class ProcessPool(object):
+    """Pool of worker processes evaluating individuals in parallel. Each
+    worker calls ``setup(*args)`` once at start up, which must prepare the
+    worker's own evaluation environment and return the primitive set the
+    individuals are decoded against. Individuals are shipped to the workers
+    as opcode arrays, the returned fitnesses are the ones the serial
+    evaluation gives.
+
+    The :meth:`map` and :meth:`submit` methods are meant to be registered
+    in the toolbox::
+
+        pool = ProcessPool(pset, setup, args)
+        toolbox.register("map", pool.map)
+        toolbox.register("submit", pool.submit)
+    """
+
+    def __init__(self, pset, setup, args=(), processes=None, chunksize=None):
+        self.pset = pset
+        self.processes = processes or os.cpu_count() or 1
+        self.chunksize = chunksize
+        self.pool = ProcessPoolExecutor(self.processes, initializer=_initWorker, initargs=(setup, args))
+
+    def map(self, evaluate, individuals):
+        codes = [gp.encode(ind, self.pset) for ind in individuals]
+        chunksize = self.chunksize
+        if chunksize is None:
+            # Same default as multiprocessing.Pool.map
+            chunksize, extra = divmod(len(codes), 4 * self.processes)
+            chunksize += 1 if extra else 0
+        return list(self.pool.map(partial(_evaluate, evaluate), codes, chunksize=max(chunksize, 1)))
+
+    def submit(self, evaluate, individual):
+        """Return a :class:`concurrent.futures.Future` of the fitness of
+        *individual*.
+        """
+        return self.pool.submit(_evaluate, evaluate, gp.encode(individual, self.pset))
+
+    def close(self):
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,252 @@
+"""Evaluation of individuals by worker services over TCP sockets.
+
+A worker calls ``setup(*args)`` once, which returns the primitive set the
+trees are decoded against and a function ``evaluate(individuals, key)``
+returning the fitness of each individual on the trail, or any other
+environment, named *key*. It then answers the evaluation requests of any
+number of clients::
+
+    python remote.py --port 7000 ant_trail:setupRemote santa-fe-trail.txt
+
+Every message is a frame made of its length as ``uint32`` followed by the
+payload. A request holds its kind, its number, the key and the trees
+packed by :func:`gp.packPopulation`, the answer the fitness values of the
+trees as ``float64`` or an error message.
+"""
+import argparse
+import asyncio
+import importlib
+import multiprocessing
+import struct
+
+from collections import deque
+
+import numpy
+
+import gp
+
+EVALUATE, RESULT, ERROR = range(1, 4)
+
+_LENGTH = struct.Struct("<I")
+# Kind, request number and length of the key of a request
+_REQUEST = struct.Struct("<BIH")
+# Kind, request number, number of fitnesses and of values per fitness
+_RESULT = struct.Struct("<BIII")
+_ERROR = struct.Struct("<BI")
+
+
+async def _readFrame(reader):
+    length, = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))
+    return await reader.readexactly(length)
+
+
+def _writeFrame(writer, *parts):
+    writer.write(_LENGTH.pack(sum(len(part) for part in parts)))
+    for part in parts:
+        writer.write(part)
+
+
+class Worker(object):
+    """Evaluation service keeping the primitive set and the environments
+    built by ``setup(*args)`` for all its clients.
+    """
+
+    def __init__(self, setup, args=()):
+        self.pset, self.evaluate = setup(*args)
+
+    def answer(self, payload):
+        kind, number, size = _REQUEST.unpack_from(payload)
+        try:
+            if kind != EVALUATE:
+                raise ValueError("Unknown request kind {}".format(kind))
+            key = payload[_REQUEST.size:_REQUEST.size + size].decode()
+            individuals = gp.unpackPopulation(payload[_REQUEST.size + size:], self.pset)
+            values = numpy.array(self.evaluate(individuals, key), dtype=numpy.float64)
+        except Exception as error:
+            return (_ERROR.pack(ERROR, number), "{}: {}".format(type(error).__name__, error).encode())
+        nvalues = values.shape[1] if values.ndim == 2 else 0
+        return (_RESULT.pack(RESULT, number, len(individuals), nvalues), values.tobytes())
+
+    async def handle(self, reader, writer):
+        # Requests of a connection are answered in order, clients send the
+        # next ones without waiting
+        try:
+            while True:
+                payload = await _readFrame(reader)
+                _writeFrame(writer, *self.answer(payload))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port, ready=None):
+        server = await asyncio.start_server(self.handle, host, port)
+        if ready is not None:
+            ready.send(server.sockets[0].getsockname()[:2])
+            ready.close()
+        async with server:
+            await server.serve_forever()
+
+
+def serve(host, port, setup, args=(), ready=None):
+    """Run a :class:`Worker` on *host* and *port*, a free port when *port*
+    is 0. The address listened on is sent through the *ready* connection
+    when given.
+    """
+    asyncio.run(Worker(setup, args).serve(host, port, ready))
+
+
+def startWorkers(n, setup, args=(), host="127.0.0.1"):
+    """Start *n* worker processes on *host* and return the processes along
+    with the addresses they listen on.
+    """
+    processes = []
+    addresses = []
+    for _ in range(n):
+        parent, child = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=serve, args=(host, 0, setup, args, child), daemon=True)
+        process.start()
+        child.close()
+        addresses.append(tuple(parent.recv()))
+        parent.close()
+        processes.append(process)
+    return processes, addresses
+
+
+class _Connection(object):
+    def __init__(self, address):
+        self.address = address
+        self.reader = None
+        self.writer = None
+        self.failures = 0
+
+    async def open(self):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(*self.address)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class RemoteMap(object):
+    """Client of the workers at *addresses* evaluating the individuals on
+    the environment named *key*. The individuals are packed against *pset*
+    and sent in batches of *batch* trees, each worker having up to
+    *inflight* batches pending so it never waits for the network. The
+    batches of a worker that dies, or does not answer within *timeout*
+    seconds, are sent again to the other ones, a worker is given up after
+    *retries* failures.
+
+    Calling the client has the signature of :func:`map` so it can be
+    registered as the toolbox map. The workers run their own evaluation,
+    the *evaluate* function it stands for, any other function passed
+    raises a :class:`ValueError`. Without *evaluate* the function passed is
+    ignored::
+
+        toolbox.register("map", RemoteMap(addresses, pset, "santa-fe-trail", evaluate=toolbox.evaluate))
+    """
+
+    def __init__(self, addresses, pset, key, batch=50, inflight=2, retries=3, timeout=60.0, evaluate=None):
+        self.connections = [_Connection(tuple(address)) for address in addresses]
+        self.pset = pset
+        self.key = key.encode()
+        self.batch = batch
+        self.inflight = inflight
+        self.retries = retries
+        self.timeout = timeout
+        self.evaluate = evaluate
+        self.loop = asyncio.new_event_loop()
+        self.number = 0
+
+    def __call__(self, evaluate, individuals):
+        if self.evaluate is not None and evaluate is not self.evaluate:
+            raise ValueError("The workers do not evaluate with {}".format(getattr(evaluate, "__name__", evaluate)))
+        individuals = list(individuals)
+        return self.loop.run_until_complete(self._map(individuals))
+
+    map = __call__
+
+    async def _map(self, individuals):
+        batches = deque()
+        for start in range(0, len(individuals), self.batch):
+            self.number += 1
+            chunk = individuals[start:start + self.batch]
+            batches.append((self.number, start, gp.packPopulation(chunk, self.pset)))
+        results = [None] * len(individuals)
+
+        # Batches left by dead workers go to the workers still alive
+        while batches:
+            alive = [conn for conn in self.connections if conn.failures <= self.retries]
+            if not alive:
+                raise ConnectionError("All the evaluation workers failed")
+            tasks = [asyncio.ensure_future(self._drive(conn, batches, results)) for conn in alive]
+            try:
+                await asyncio.gather(*tasks)
+            except Exception:
+                # Answers still pending would be read by the next call
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                for conn in self.connections:
+                    conn.close()
+                raise
+        return results
+
+    async def _drive(self, conn, batches, results):
+        pending = dict()
+        try:
+            await conn.open()
+            while batches or pending:
+                while batches and len(pending) < self.inflight:
+                    number, start, packed = batches.popleft()
+                    pending[number] = (number, start, packed)
+                    _writeFrame(conn.writer, _REQUEST.pack(EVALUATE, number, len(self.key)), self.key, packed)
+                await conn.writer.drain()
+                if not pending:
+                    break
+                payload = await asyncio.wait_for(_readFrame(conn.reader), self.timeout)
+                self._collect(payload, pending, results)
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            conn.failures += 1
+            conn.close()
+            batches.extendleft(reversed(list(pending.values())))
+
+    def _collect(self, payload, pending, results):
+        kind, number = _ERROR.unpack_from(payload)
+        if kind == ERROR:
+            raise RuntimeError("Evaluation failed on a worker: " + payload[_ERROR.size:].decode())
+        _, number, count, nvalues = _RESULT.unpack_from(payload)
+        _, start, _ = pending.pop(number)
+        values = numpy.frombuffer(payload, dtype=numpy.float64, offset=_RESULT.size).reshape(count, nvalues)
+        results[start:start + count] = [tuple(value) for value in values.tolist()]
+
+    def close(self):
+        for conn in self.connections:
+            conn.close()
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the evaluation of individuals over TCP.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=7000)
+    parser.add_argument("setup", help="setup function as module:function")
+    parser.add_argument("args", nargs="*", help="arguments of the setup function")
+    args = parser.parse_args(argv)
+
+    module, function = args.setup.split(":")
+    serve(args.host, args.port, getattr(importlib.import_module(module), function), tuple(args.args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,88 @@
+import csv
+import heapq
+import json
+import time
+
 from bisect import bisect_right
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
 from copy import deepcopy
 from functools import partial
+from itertools import count
 from operator import eq
 
+import numpy
+
 def identity(obj):
     return obj
 
 
 class registerfitness(object):
+    """Statistics computed by the registered functions on the values *key*
+    gives for each element of the data. The values are gathered in a single
+    NumPy buffer, of the type of the values, reused from one generation to
+    the next. The functions receive a read only view of the buffer, a result
+    sharing its memory is copied so the next generation does not change it.
+    """
+
     def __init__(self, key=identity):
         self.key = key
         self.functions = dict()
         self.fields = []
+        self.buffer = None
 
     def register(self, name, function, *args, **kargs):
         self.functions[name] = partial(function, *args, **kargs)
         self.fields.append(name)
 
     def compile(self, data):
-        values = tuple(self.key(elem) for elem in data)
+        return self.compileValues([self.key(elem) for elem in data])
+
+    def compileValues(self, values):
+        """Return the statistics of *values* already given by the key."""
+        values = numpy.asarray(values)
+        buffer = self.buffer
+        if buffer is None or buffer.shape[1:] != values.shape[1:] or buffer.dtype != values.dtype \
+                or len(buffer) < len(values):
+            buffer = self.buffer = numpy.empty(values.shape, dtype=values.dtype)
+        view = buffer[:len(values)]
+        view[:] = values
+        view = view.view()
+        view.setflags(write=False)
+
         entry = dict()
         for key, func in self.functions.items():
-            entry[key] = func(values)
+            result = func(view)
+            if isinstance(result, numpy.ndarray) and numpy.may_share_memory(result, buffer):
+                result = result.copy()
+            entry[key] = result
         return entry
 
 
 class LogStats(list):
+    """Records of an evolution. Each record can also be written to a *sink*
+    as soon as it is recorded, such as a :class:`JSONLinesSink`, and with a
+    *maxlen* only the last records are kept in memory.
+    """
 
-    def __init__(self):
+    def __init__(self, sink=None, maxlen=None):
         self.buffindex = 0
-        self.chapters = defaultdict(LogStats)
+        self.chapters = defaultdict(partial(LogStats, maxlen=maxlen))
         self.columns_len = None
         self.header = None
         self.log_header = True
+        self.sink = sink
+        self.maxlen = maxlen
+
+    def __getstate__(self):
+        # Sinks hold open files, they are not part of the saved records
+        state = self.__dict__.copy()
+        state["sink"] = None
+        return state
 
     def record(self, **infos):
+        if self.sink is not None:
+            self.sink.write(infos)
 
         apply_to_all = {k: v for k, v in list(infos.items()) if not isinstance(v, dict)}
         for key, value in list(infos.items()):
@@ -45,15 +92,249 @@ class LogStats(list):
                 self.chapters[key].record(**chapter_infos)
                 del infos[key]
         self.append(infos)
+        if self.maxlen is not None and len(self) > self.maxlen:
+            del self[:len(self) - self.maxlen]
+
+
+def _flatten(record, prefix=""):
+    flat = dict()
+    for key, value in record.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, prefix + key + "."))
+        else:
+            flat[prefix + key] = value.item() if isinstance(value, numpy.generic) else value
+    return flat
+
+
+class JSONLinesSink(object):
+    """Append every record to the file *path* as a line of JSON, the
+    chapters of a record being nested objects.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "a")
+
+    def write(self, record):
+        self.file.write(json.dumps(record, default=_jsonDefault) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def _jsonDefault(obj):
+    if isinstance(obj, numpy.generic):
+        return obj.item()
+    raise TypeError("Object of type {} is not JSON serializable".format(type(obj).__name__))
+
+
+class CSVSink(object):
+    """Append every record to the file *path* as a row of CSV, the columns
+    of chapters being named ``chapter.column``. A record bringing new
+    columns, such as a phase first timed after generation 0, rewrites the
+    file with the wider header, earlier rows leaving these cells empty.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "a+", newline="")
+        self.file.seek(0)
+        self.fields = next(csv.reader(self.file), [])
+        self.writer = csv.DictWriter(self.file, fieldnames=self.fields)
+
+    def write(self, record):
+        record = _flatten(record)
+        fields = [key for key in record if key not in self.fields]
+        if fields:
+            self._extend(fields)
+        self.writer.writerow(record)
+        self.file.flush()
+
+    def _extend(self, fields):
+        self.file.seek(0)
+        rows = list(csv.DictReader(self.file))
+        self.fields = self.fields + fields
+        self.file.seek(0)
+        self.file.truncate()
+        self.writer = csv.DictWriter(self.file, fieldnames=self.fields)
+        self.writer.writeheader()
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+def readStream(path):
+    """Return the records streamed to *path* by a :class:`JSONLinesSink` or a
+    :class:`CSVSink`. Chapters of CSV records stay flattened. A generation
+    recorded more than once, as after resuming from a checkpoint, keeps its
+    last record.
+    """
+    with open(path, newline="") as stream:
+        if path.endswith(".csv"):
+            records = [dict((key, _number(value)) for key, value in row.items())
+                       for row in csv.DictReader(stream)]
+        else:
+            records = [json.loads(line) for line in stream if line.strip()]
+    latest = OrderedDict()
+    for i, record in enumerate(records):
+        latest[record.get("gen", ("record", i))] = record
+    return list(latest.values())
+
+
+def _number(value):
+    for type_ in (int, float):
+        try:
+            return type_(value)
+        except ValueError:
+            pass
+    return value
+
+
+class Hook(object):
+    """Base class of the subscribers of an :class:`Instrumentation`, the
+    methods are called at the end of each phase and of each generation.
+    """
+
+    def phase(self, name, elapsed):
+        pass
+
+    def generation(self, gen, record):
+        pass
+
+
+class Instrumentation(object):
+    """Accumulate the wall time spent in each phase of a generation along
+    with counters, such as the number of evaluations or simulated moves, and
+    peak values. :meth:`flush` returns them as a record for a chapter of the
+    logbook, with the evaluations and moves per second derived from the
+    ``evaluate`` and ``simulate`` phases.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.hooks = []
+        self.times = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.peaks = dict()
+        self.start = clock()
+
+    def subscribe(self, hook):
+        self.hooks.append(hook)
+
+    def unsubscribe(self, hook):
+        self.hooks.remove(hook)
+
+    @contextmanager
+    def phase(self, name):
+        start = self.clock()
+        try:
+            yield
+        finally:
+            elapsed = self.clock() - start
+            self.times[name] += elapsed
+            for hook in self.hooks:
+                hook.phase(name, elapsed)
+
+    def count(self, name, value=1):
+        self.counts[name] += value
+
+    def peak(self, name, value):
+        if value > self.peaks.get(name, value - 1):
+            self.peaks[name] = value
+
+    def flush(self, gen):
+        """Return the record of the generation *gen* and start a new one."""
+        now = self.clock()
+        record = dict(self.times)
+        record.update(self.counts)
+        record.update(self.peaks)
+        record["total"] = now - self.start
+        if self.times.get("evaluate"):
+            record["evals_per_sec"] = self.counts.get("evals", 0) / self.times["evaluate"]
+        if self.times.get("simulate"):
+            record["moves_per_sec"] = self.counts.get("moves", 0) / self.times["simulate"]
+        for hook in self.hooks:
+            hook.generation(gen, record)
+
+        self.times.clear()
+        self.counts.clear()
+        self.peaks.clear()
+        self.start = now
+        return record
+
+
+class EvaluationCache(object):
+    """Least recently used cache of fitness values. The *key* function must
+    return a hashable value identifying everything the fitness depends on,
+    individuals sharing a key are evaluated only once.
+    """
+
+    def __init__(self, maxsize, key):
+        self.maxsize = maxsize
+        self.key = key
+        self.values = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.flushed = (0, 0)
+
+    def evaluate(self, batch, individuals):
+        """Return the fitnesses of *individuals*, calling ``batch(misses)`` on
+        the list of individuals not found in the cache.
+        """
+        keys = [self.key(ind) for ind in individuals]
+        pending = OrderedDict()
+        for key, ind in zip(keys, individuals):
+            if key in self.values:
+                self.hits += 1
+                self.values.move_to_end(key)
+            elif key in pending:
+                self.hits += 1
+            else:
+                self.misses += 1
+                pending[key] = ind
+
+        fitnesses = dict((key, self.values[key]) for key in keys if key in self.values)
+        for key, fit in zip(pending, batch(list(pending.values()))):
+            fitnesses[key] = fit
+            self.values[key] = fit
+        while len(self.values) > self.maxsize:
+            self.values.popitem(last=False)
+        return [fitnesses[key] for key in keys]
+
+    def flush(self):
+        """Return the hits and misses counted since the last flush."""
+        hits, misses = self.flushed
+        self.flushed = (self.hits, self.misses)
+        return dict(hits=self.hits - hits, misses=self.misses - misses)
+
+    def getstate(self):
+        """Return the cached values and counters, restored by
+        :meth:`setstate`.
+        """
+        return list(self.values.items()), self.hits, self.misses, self.flushed
+
+    def setstate(self, state):
+        values, self.hits, self.misses, self.flushed = state
+        self.values = OrderedDict(values)
+
+    def clear(self):
+        self.values.clear()
+        self.hits = 0
+        self.misses = 0
+        self.flushed = (0, 0)
+
+    def __len__(self):
+        return len(self.values)
 
 
 class HallOfFame(object):
 
-    def __init__(self, maxsize, similar=eq):
+    def __init__(self, maxsize, similar=eq, clone=deepcopy):
         self.maxsize = maxsize
         self.keys = list()
         self.items = list()
         self.similar = similar
+        self.clone = clone
 
     def update(self, population):
         for ind in population:
@@ -77,7 +358,7 @@ class HallOfFame(object):
 
     def insert(self, item):
 
-        item = deepcopy(item)
+        item = self.clone(item)
         i = bisect_right(self.keys, item.fitness)
         self.items.insert(len(self) - i, item)
         self.keys.insert(i, item.fitness)
@@ -107,3 +388,77 @@ class HallOfFame(object):
     def __str__(self):
         return str(self.items)
 
+
+class HashedHallOfFame(object):
+    """Hall of fame for large sizes, with the same content and order as
+    :class:`HallOfFame` when *key* tells similar individuals apart. The
+    members are kept in a heap with the worst one on top and their keys in
+    a set, so an update costs a logarithmic time per inserted individual.
+    The population is first filtered against the worst member in a single
+    pass over its fitness values.
+    """
+
+    def __init__(self, maxsize, key, clone=deepcopy):
+        self.maxsize = maxsize
+        self.key = key
+        self.clone = clone
+        self.heap = list()
+        self.members = set()
+        self.counter = count()
+        self.sorted = None
+
+    def update(self, population):
+        if self.maxsize == 0:
+            return
+        candidates = population
+        if len(self.heap) >= self.maxsize:
+            # The worst member only gets better during the update
+            worst = self.heap[0][0]
+            values = numpy.array([ind.fitness.wvalues[0] for ind in population])
+            candidates = [population[i] for i in numpy.nonzero(values >= worst[0])[0]]
+
+        for ind in candidates:
+            full = len(self.heap) >= self.maxsize
+            if full and not ind.fitness.wvalues > self.heap[0][0]:
+                continue
+            key = self.key(ind)
+            if key in self.members:
+                continue
+            # Ties are broken on insertion order, the oldest being the worst
+            entry = (ind.fitness.wvalues, next(self.counter), key, self.clone(ind))
+            if full:
+                self.members.discard(heapq.heapreplace(self.heap, entry)[2])
+            else:
+                heapq.heappush(self.heap, entry)
+            self.members.add(key)
+            self.sorted = None
+
+    @property
+    def items(self):
+        if self.sorted is None:
+            self.sorted = [entry[3] for entry in sorted(self.heap, reverse=True)]
+        return self.sorted
+
+    @property
+    def keys(self):
+        return [item.fitness for item in reversed(self.items)]
+
+    def clear(self):
+        del self.heap[:]
+        self.members.clear()
+        self.sorted = None
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __getitem__(self, i):
+        return self.items[i]
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __reversed__(self):
+        return reversed(self.items)
+
+    def __str__(self):
+        return str(self.items)
@@ -0,0 +1,107 @@
+import os
+import random
+import subprocess
+import sys
+
+import pytest
+
+import algorithms
+import ant_trail
+import creator
+import support
+import trails
+
+TRAIL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "santa-fe-trail.txt")
+
+
+@pytest.fixture
+def parents():
+    random.seed(1)
+    with open(TRAIL) as trail_file:
+        ant_trail.ant_trail.matrix_parse(trail_file)
+    individuals = ant_trail.toolbox.population(n=200)
+    for ind in individuals:
+        ind.fitness.values = ant_trail.evalSantaFeTrail(ind, coverage=True)
+    return individuals
+
+
+def fitness(ind):
+    return ant_trail.evalSantaFeTrail(creator.Individual(ind))
+
+
+def coverage(ind):
+    copy = creator.Individual(ind)
+    ant_trail.evalSantaFeTrail(copy, coverage=True)
+    return copy.coverage.first
+
+
+def test_inherited_fitness_is_exact(parents):
+    offspring = algorithms.variation(parents, ant_trail.toolbox, 0.9, 0.5)
+    inherited = algorithms.inheritFitness(parents, offspring)
+    assert inherited > 0
+    for child in offspring:
+        if child.fitness.valid:
+            assert child.fitness.values == fitness(child)
+
+
+def test_resumed_simulation_is_exact(parents):
+    offspring = algorithms.variation(parents, ant_trail.toolbox, 0.9, 0.5)
+    algorithms.inheritFitness(parents, offspring)
+    resumed = [child for child in offspring if getattr(child, "resume", None) is not None]
+    assert resumed
+    for child in resumed:
+        expected = fitness(child)
+        assert ant_trail.evalSantaFeTrail(child, resume=True) == expected
+        assert list(child.coverage.first) == list(coverage(child))
+
+
+def test_inherited_over_generations(parents):
+    population = parents[:50]
+    toolbox = ant_trail.toolbox
+    toolbox.register("evaluate", ant_trail.evalSantaFeTrail, coverage=True, resume=True)
+    try:
+        for _ in range(5):
+            selected = toolbox.select(population, len(population))
+            offspring = algorithms.variation(selected, toolbox, 0.9, 0.1)
+            algorithms.inheritFitness(selected, offspring)
+            algorithms.evaluation(offspring, toolbox)
+            assert [ind.fitness.values for ind in offspring] == [fitness(ind) for ind in offspring]
+            population = offspring
+    finally:
+        toolbox.register("evaluate", ant_trail.evalSantaFeTrail)
+
+
+def test_trail_key_is_stable_across_processes():
+    code = "import trails; print(trails.generateTrail('key', 32, 32, seed=3).key.hex())"
+    keys = set()
+    for seed in ("1", "2"):
+        env = dict(os.environ, PYTHONHASHSEED=seed)
+        keys.add(subprocess.check_output([sys.executable, "-c", code], env=env,
+                                         cwd=os.path.dirname(TRAIL)).strip())
+    assert keys == {trails.generateTrail("key", 32, 32, seed=3).key.hex().encode()}
+
+
+def test_worlds_are_bounded():
+    simulator = ant_trail.AntSimulator(600, max_worlds=2)
+    generated = [trails.generateTrail(str(seed), 16, 16, seed=seed) for seed in range(3)]
+    for trail in generated:
+        simulator.load(trail)
+    assert list(simulator.worlds) == [generated[1].key, generated[2].key]
+    simulator.load(generated[1])
+    simulator.load(generated[0])
+    assert list(simulator.worlds) == [generated[1].key, generated[0].key]
+
+
+def test_simplify_before_evaluation(parents):
+    toolbox = ant_trail.runToolbox()
+    toolbox.register("simplify", ant_trail.simplifyIndividual)
+    offspring = [toolbox.clone(ind) for ind in parents]
+    expected = [fitness(ind) for ind in offspring]
+    for ind in offspring:
+        del ind.fitness.values
+    cache = support.EvaluationCache(1000, key=lambda ind: tuple(node.name for node in ind))
+    algorithms.evaluation(offspring, toolbox, cache)
+    assert [ind.fitness.values for ind in offspring] == expected
+    assert sum(map(len, offspring)) < sum(map(len, parents))
+    # The cache was keyed on the simplified nodes
+    assert all(tuple(node.name for node in ind) in cache.values for ind in offspring)
@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+import ant_trail
+import checkpoint
+import creator
+import support
+
+TRAIL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "santa-fe-trail.txt")
+
+
+def test_background_write_error(tmp_path):
+    population = ant_trail.toolbox.population(n=5)
+    checkpoints = checkpoint.Checkpoint(os.path.join(str(tmp_path), "missing", "run.npz"), ant_trail.pTree,
+                                        creator.Individual)
+    checkpoints.save(0, population, None, [])
+    with pytest.raises(FileNotFoundError):
+        checkpoints.wait()
+    # The error is raised once
+    checkpoints.wait()
+
+
+def test_load_restores_cache(tmp_path):
+    path = os.path.join(str(tmp_path), "run.npz")
+    with open(TRAIL) as trail_file:
+        ant_trail.ant_trail.matrix_parse(trail_file)
+    population = ant_trail.toolbox.population(n=5)
+    for ind in population:
+        ind.fitness.values = ant_trail.evalSantaFeTrail(ind)
+    cache = support.EvaluationCache(10, key=len)
+    cache.evaluate(lambda inds: [ind.fitness.values for ind in inds], population)
+    cache.flush()
+    checkpoint.Checkpoint(path, ant_trail.pTree, creator.Individual, background=False).save(
+        0, population, None, [], cache)
+
+    restored = support.EvaluationCache(10, key=len)
+    copy = []
+    gen, _ = checkpoint.Checkpoint(path, ant_trail.pTree, creator.Individual).load(copy, cache=restored)
+    assert gen == 0
+    assert [list(ind) for ind in copy] == [list(ind) for ind in population]
+    assert restored.getstate() == cache.getstate()
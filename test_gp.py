@@ -0,0 +1,136 @@
+import operator
+import os
+import pickle
+import random
+
+import pytest
+
+import ant_trail
+import creator
+import gp
+
+TRAIL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "santa-fe-trail.txt")
+
+
+@pytest.fixture
+def population():
+    random.seed(0)
+    with open(TRAIL) as trail_file:
+        ant_trail.ant_trail.matrix_parse(trail_file)
+    individuals = [creator.Individual(gp.generationHalfAndHalf(ant_trail.pTree, 1, 6)) for _ in range(50)]
+    for ind in individuals[1:]:
+        ind.fitness.values = ant_trail.evalSantaFeTrail(ind)
+    return individuals
+
+
+@pytest.mark.parametrize("cls", [gp.Tree, creator.Individual])
+def test_pack_population_round_trip(population, cls):
+    unpacked = gp.unpackPopulation(gp.packPopulation(population, ant_trail.pTree), ant_trail.pTree, cls)
+    assert len(unpacked) == len(population)
+    for ind, copy in zip(population, unpacked):
+        assert type(copy) is cls
+        assert list(copy) == list(ind)
+        if cls is creator.Individual:
+            assert copy.fitness.valid == ind.fitness.valid
+            assert copy.fitness.values == ind.fitness.values
+
+
+@pytest.mark.parametrize("cls", [gp.Tree, creator.Individual])
+def test_pack_tree_round_trip(population, cls):
+    ind = population[1]
+    copy = gp.unpackTree(gp.packTree(ind, ant_trail.pTree), ant_trail.pTree, cls)
+    assert list(copy) == list(ind)
+    assert not hasattr(copy, "fitness") or copy.fitness.values == ind.fitness.values
+
+
+def test_unpack_other_pset(population):
+    pset = gp.PrimitiveSet("OTHER", 0)
+    pset.functionSet(operator.add, 2)
+    pset.terminalSet(1)
+    with pytest.raises(ValueError):
+        gp.unpackPopulation(gp.packPopulation(population, ant_trail.pTree), pset)
+
+
+def test_pack_after_rename():
+    random.seed(0)
+    pset = gp.PrimitiveSet("MAIN", 2)
+    pset.functionSet(operator.add, 2)
+    pset.functionSet(operator.mul, 2)
+    pset.terminalSet(1)
+    pset.renameArguments(ARG0="x")
+    trees = [gp.Tree(gp.generationFull(pset, 2, 4)) for _ in range(20)]
+    assert any(node.name == "x" for tree in trees for node in tree)
+
+    assert gp.decode(gp.encode(trees[0], pset), pset) == list(trees[0])
+    unpacked = gp.unpackPopulation(gp.packPopulation(trees, pset), pset)
+    assert [list(tree) for tree in unpacked] == [list(tree) for tree in trees]
+    assert [gp.compile(tree, pset)(2, 3) for tree in unpacked] == [gp.compile(tree, pset)(2, 3) for tree in trees]
+
+
+SantaFeTree = creator.ArrayIndividual
+
+
+def assert_arrays(tree):
+    tree = SantaFeTree(tree) if not isinstance(tree, SantaFeTree) else tree
+    plain = gp.Tree(tree)
+    fresh = SantaFeTree(plain)
+    assert tree.codes.tolist() == fresh.codes.tolist()
+    assert tree.ends.tolist() == fresh.ends.tolist()
+    assert tree.depths.tolist() == fresh.depths.tolist()
+    assert tree.height == plain.height
+    assert [tree.searchSubtree(i) for i in range(len(tree))] == [plain.searchSubtree(i) for i in range(len(plain))]
+
+
+def test_array_tree_matches_tree():
+    random.seed(2)
+    for _ in range(50):
+        assert_arrays(SantaFeTree(gp.generationHalfAndHalf(ant_trail.pTree, 1, 6)))
+
+
+def test_array_tree_after_variation():
+    random.seed(3)
+    trees = [SantaFeTree(gp.generationHalfAndHalf(ant_trail.pTree, 1, 6)) for _ in range(50)]
+    for tree1, tree2 in zip(trees[::2], trees[1::2]):
+        child1, child2 = gp.onepointcrossover(gp.clone(tree1), gp.clone(tree2))
+        mutant, = gp.uniformmutation(gp.clone(child1), ant_trail.toolbox.expr_mut, ant_trail.pTree)
+        for tree in (tree1, tree2, child1, child2, mutant):
+            assert_arrays(tree)
+
+
+def test_array_tree_delete():
+    random.seed(4)
+    tree = SantaFeTree(gp.generationFull(ant_trail.pTree, 3, 3))
+    codes, ends, depths = tree.codes.tolist(), tree.ends.tolist(), tree.depths.tolist()
+    subtree = tree.searchSubtree(1)
+    nodes = tree[subtree]
+    del tree[subtree]
+    assert tree.codes.tolist() == [ant_trail.pTree.opcodes[node.name] for node in tree]
+    # Putting the subtree back gives the arrays of the original tree
+    tree[1:1] = nodes
+    assert (tree.codes.tolist(), tree.ends.tolist(), tree.depths.tolist()) == (codes, ends, depths)
+    assert_arrays(tree)
+
+
+def test_array_tree_list_mutators():
+    tree = SantaFeTree(gp.generationFull(ant_trail.pTree, 2, 2))
+    for mutate in (lambda: tree.append(tree[-1]), lambda: tree.extend(tree[-1:]), lambda: tree.insert(0, tree[-1]),
+                   tree.pop, tree.reverse, tree.clear):
+        with pytest.raises(TypeError):
+            mutate()
+    with pytest.raises(TypeError):
+        tree += tree[-1:]
+
+
+def test_array_tree_pickle():
+    random.seed(5)
+    tree = SantaFeTree(gp.generationHalfAndHalf(ant_trail.pTree, 1, 6))
+    tree.fitness.values = (3.0,)
+    copy = pickle.loads(pickle.dumps(tree))
+    assert type(copy) is SantaFeTree and list(copy) == list(tree)
+    assert copy.fitness.values == (3.0,)
+    assert_arrays(copy)
+
+
+def test_array_tree_without_pset():
+    with pytest.raises(TypeError):
+        gp.ArrayTree([])
@@ -0,0 +1,15 @@
+import numpy
+
+import support
+
+
+def test_statistics_keep_type_and_earlier_results():
+    stats = support.registerfitness(lambda ind: ind)
+    stats.register("values", lambda values: values)
+    stats.register("max", numpy.max)
+    first = stats.compile([(1,), (5,)])
+    second = stats.compile([(7,), (9,)])
+    assert first["values"].tolist() == [[1], [5]]
+    assert second["values"].tolist() == [[7], [9]]
+    assert first["max"] == 5 and numpy.issubdtype(type(first["max"]), numpy.integer)
+    assert stats.compile([(1.5,), (2.0,)])["max"] == 2.0
@@ -0,0 +1,201 @@
+import hashlib
+import mmap
+import os
+import random
+import struct
+
+from collections import OrderedDict
+
+EMPTY, FOOD = 0, 1
+
+# Header of the trail files: magic, rows, columns, start row, start column
+_HEADER = struct.Struct("<4sIIII")
+_MAGIC = b"TRL1"
+
+
+class Trail(object):
+    """Immutable parsed trail. The cells are stored row major in the bytes
+    like buffer :attr:`grid`, one byte per cell holding either
+    :data:`EMPTY` or :data:`FOOD`, the ant starting at :attr:`start` facing
+    east. Trails loaded with :meth:`load` are memory mapped, every process
+    loading the same file shares its pages.
+    """
+    __slots__ = ("name", "rows", "cols", "start", "grid", "food", "key")
+
+    def __init__(self, name, rows, cols, start, grid):
+        if len(grid) != rows * cols:
+            raise ValueError("Trail {} has {} cells, expected {}x{}".format(name, len(grid), rows, cols))
+        self.name = name
+        self.rows = rows
+        self.cols = cols
+        self.start = start
+        self.grid = grid
+        self.food = bytes(grid).count(FOOD)
+        # Digest rather than hash() so that every process computes the same key
+        self.key = hashlib.sha1(_HEADER.pack(_MAGIC, rows, cols, start[0], start[1]) + bytes(grid)).digest()
+
+    @classmethod
+    def parse(cls, name, lines):
+        """Parse a trail drawn with ``#`` for food, ``.`` for empty cells and
+        ``S`` for the starting cell.
+        """
+        rows = list()
+        start = None
+        for index, line in enumerate(lines):
+            rows.append(bytearray())
+            for lIndex, lcol in enumerate(line):
+                if lcol == "#":
+                    rows[-1].append(FOOD)
+                elif lcol == ".":
+                    rows[-1].append(EMPTY)
+                elif lcol == "S":
+                    rows[-1].append(EMPTY)
+                    start = (index, lIndex)
+        if start is None:
+            raise ValueError("Trail {} has no starting cell".format(name))
+        return cls(name, len(rows), len(rows[0]), start, bytes(b"".join(rows)))
+
+    def save(self, path):
+        with open(path, "wb") as trail_file:
+            trail_file.write(_HEADER.pack(_MAGIC, self.rows, self.cols, self.start[0], self.start[1]))
+            trail_file.write(self.grid)
+
+    @classmethod
+    def load(cls, path, name=None):
+        """Memory map the trail file *path* written by :meth:`save`."""
+        with open(path, "rb") as trail_file:
+            mapping = mmap.mmap(trail_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, rows, cols, row, col = _HEADER.unpack_from(mapping)
+        if magic != _MAGIC:
+            raise ValueError("{} is not a trail file".format(path))
+        if name is None:
+            name = os.path.splitext(os.path.basename(path))[0]
+        return cls(name, rows, cols, (row, col), memoryview(mapping)[_HEADER.size:])
+
+    def __str__(self):
+        lines = []
+        for row in range(self.rows):
+            cells = self.grid[row * self.cols:(row + 1) * self.cols]
+            lines.append("".join("#" if cell == FOOD else "." for cell in cells))
+        row, col = self.start
+        lines[row] = lines[row][:col] + "S" + lines[row][col + 1:]
+        return "\n".join(lines)
+
+
+class TrailRegistry(object):
+    """Trails indexed by name, each one parsed or generated once."""
+
+    def __init__(self):
+        self.trails = OrderedDict()
+
+    def add(self, trail):
+        self.trails[trail.name] = trail
+        return trail
+
+    def parse(self, name, path):
+        with open(path) as trail_file:
+            return self.add(Trail.parse(name, trail_file))
+
+    def generate(self, name, rows, cols, seed, **kargs):
+        return self.add(generateTrail(name, rows, cols, seed, **kargs))
+
+    def share(self, directory):
+        """Write every trail to *directory* and replace it by its memory
+        mapped copy, a registry opened on *directory* in other processes
+        then shares the same pages.
+        """
+        for name, trail in list(self.trails.items()):
+            path = os.path.join(directory, name + ".trail")
+            trail.save(path)
+            self.trails[name] = Trail.load(path, name)
+
+    @classmethod
+    def open(cls, directory):
+        registry = cls()
+        for filename in sorted(os.listdir(directory)):
+            if filename.endswith(".trail"):
+                registry.add(Trail.load(os.path.join(directory, filename)))
+        return registry
+
+    def select(self, names):
+        return [self.trails[name] for name in names]
+
+    def __getitem__(self, name):
+        return self.trails[name]
+
+    def __contains__(self, name):
+        return name in self.trails
+
+    def __iter__(self):
+        return iter(self.trails.values())
+
+    def __len__(self):
+        return len(self.trails)
+
+
+def generateTrail(name, rows, cols, seed, length=None, turn=0.2, gap=0.1, max_gap=3):
+    """Generate a Santa Fe like trail of at most *length* cells, a seventh of
+    the grid by default. The trail starts in the top left corner heading
+    east, goes straight and turns left or right with probability *turn* at
+    each cell, and never touches itself so the ant can only follow it. When
+    the walk can not reach *length* cells, the longest one found is kept.
+    The cells after the empty starting cell are left without food with
+    probability *gap*, in runs of at most *max_gap* cells, the last cell
+    always holding food.
+    """
+    rng = random.Random(seed)
+    if length is None:
+        length = rows * cols // 7
+    moves = [(0, 1), (1, 0), (0, -1), (-1, 0)]
+
+    def neighbours(row, col):
+        return [((row + drow) % rows, (col + dcol) % cols) for drow, dcol in moves]
+
+    def headings(heading):
+        # Straight ahead first unless the trail turns, never back
+        turns = [(heading + 1) % 4, (heading + 3) % 4]
+        rng.shuffle(turns)
+        if rng.random() < turn:
+            return turns[:1] + [heading] + turns[1:]
+        return [heading] + turns
+
+    # Depth first walk, a dead end is backtracked to the last cell with an
+    # untried heading and the cells left behind are never entered again
+    path = [(0, 0)]
+    visited = {(0, 0)}
+    dead = set()
+    untried = [headings(0)]
+    longest = list(path)
+    while path and len(path) < length:
+        row, col = path[-1]
+        if not untried[-1]:
+            if len(path) > len(longest):
+                longest = list(path)
+            cell = path.pop()
+            visited.discard(cell)
+            dead.add(cell)
+            untried.pop()
+            continue
+        heading = untried[-1].pop(0)
+        drow, dcol = moves[heading]
+        cell = ((row + drow) % rows, (col + dcol) % cols)
+        # The next cell only touches the current one
+        if cell in visited or cell in dead:
+            continue
+        if all(n == (row, col) or n not in visited for n in neighbours(*cell)):
+            path.append(cell)
+            visited.add(cell)
+            untried.append(headings(heading))
+    if len(path) < len(longest):
+        path = longest
+
+    grid = bytearray(rows * cols)
+    run = 0
+    for index, (row, col) in enumerate(path):
+        if 0 < index < len(path) - 1 and run < max_gap and rng.random() < (gap if run == 0 else 0.5):
+            run += 1
+            continue
+        run = 0
+        grid[row * cols + col] = FOOD
+    grid[0] = EMPTY
+    return Trail(name, rows, cols, (0, 0), bytes(grid))